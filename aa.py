@@ -0,0 +1,152 @@
+"""
+    姿勢資料庫 (最近鄰分類)
+    b.py 用寫死的膝蓋角度範圍判斷深蹲，每多一個動作就要多一串條件
+    改成把很多已經標記好的參考幀的角度向量 (key_points 的 23 個角度) 存成一個矩陣
+    每一列事先除以長度，查詢時一次矩陣乘法就得到與所有參考幀的餘弦相似度 (與 m.py 的 angle_similarity 相同)
+    再取最相似的 k 個，參考幀有幾百個動作、幾萬幀時每一幀的查詢也在 1 毫秒以內
+    用法: python aa.py build library.npz squat=squat.npz stand=B4.mp4
+          python aa.py classify library.npz B3.mp4
+"""
+
+
+import argparse
+import time
+from collections import namedtuple
+import numpy as np
+from m import KEY_POINTS, calculate_angles
+
+# 查詢的結果
+pose_match = namedtuple('pose_match', [
+    'label',        # 參考幀的標記
+    'similarity',   # 角度的餘弦相似度 (百分比)
+    'index'         # 參考幀在資料庫中的位置
+])
+
+
+class pose_library:
+    # key_points: 用哪些關鍵點組的角度比較，例如只看膝蓋時傳入 KEY_POINTS[2:4]
+    def __init__(self, key_points=KEY_POINTS):
+        self.key_points = key_points
+        self.label_names = []                   # 所有出現過的標記
+        self.labels = np.zeros(0, dtype=np.intp)    # 每一個參考幀的標記 (label_names 的位置)
+        self.matrix = np.zeros((0, len(key_points)), dtype=np.float32)  # 除以長度後的角度向量 (N, K)
+
+    def __len__(self):
+        return len(self.labels)
+
+    # 加入一幀 (33, 3 以上) 或多幀 (T, 33, 3 以上) 的參考骨架，mask 為 False 的幀 (沒有偵測到) 不加入
+    def add(self, label, points, mask=None):
+        points = np.asarray(points)
+        if points.ndim == 2:
+            points = points[None]
+        if mask is not None:
+            points = points[mask]
+        if label not in self.label_names:
+            self.label_names.append(label)
+
+        vectors = self.normalize(calculate_angles(points, self.key_points))
+        self.matrix = np.concatenate((self.matrix, vectors))
+        self.labels = np.concatenate((self.labels, np.full(len(vectors), self.label_names.index(label))))
+
+    # 加入 p.py 的 landmark_track，可以只取 start ~ end 秒
+    def add_track(self, label, track, start=0.0, end=None):
+        keep = track.mask & (track.timestamps >= start)
+        if end is not None:
+            keep &= track.timestamps <= end
+        self.add(label, track.landmarks, keep)
+
+    # 角度向量除以長度，之後的內積就是餘弦相似度
+    @staticmethod
+    def normalize(angles):
+        angles = np.asarray(angles, dtype=np.float32)
+        norms = np.linalg.norm(angles, axis=-1, keepdims=True)
+        return angles / np.maximum(norms, 1e-6)
+
+    # 找出最相似的 k 個參考幀
+    # points 為一幀 (33, 3 以上) 時回傳 k 個 pose_match 的 list
+    # points 為多幀 (T, 33, 3 以上) 時一次查詢，回傳 index (T, k) 與 similarity (T, k)，由相似到不相似排序
+    def query(self, points, k=1):
+        points = np.asarray(points)
+        single = points.ndim == 2
+        vectors = self.normalize(calculate_angles(points[None] if single else points, self.key_points))
+
+        k = min(k, len(self))
+        scores = vectors @ self.matrix.T                    # (T, N)
+        if k < len(self):
+            index = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            index = np.broadcast_to(np.arange(len(self)), scores.shape)
+        top = np.take_along_axis(scores, index, axis=1)
+        order = np.argsort(-top, axis=1)
+        index = np.take_along_axis(index, order, axis=1)
+        similarity = np.take_along_axis(top, order, axis=1) * 100
+
+        if not single:
+            return index, similarity
+        return [pose_match(self.label_names[self.labels[i]], float(s), int(i)) for i, s in zip(index[0], similarity[0])]
+
+    # 判斷姿勢：最相似的 k 個參考幀中最多的標記，相似度低於 threshold 時回傳 None
+    def classify(self, points, k=1, threshold=None):
+        matches = self.query(points, k)
+        if not matches or (threshold is not None and matches[0].similarity < threshold):
+            return None
+        votes = [match.label for match in matches]
+        return max(votes, key=votes.count)
+
+    # 存成 .npz，標記存成字串陣列
+    def save(self, path):
+        np.savez_compressed(path, key_points=self.key_points, labels=self.labels, matrix=self.matrix,
+                            label_names=np.array(self.label_names, dtype=str))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            library = cls(data['key_points'])
+            library.label_names = data['label_names'].tolist()
+            library.labels = data['labels']
+            library.matrix = data['matrix']
+        return library
+
+
+# 影片或 p.py 存的 .npz 都可以當作參考
+def read_track(path, adjust=3):
+    from p import extract_landmarks, load_track
+    if path.endswith('.npz'):
+        return load_track(path)
+    return extract_landmarks(path, adjust)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="pose library")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="把標記好的影片建成姿勢資料庫")
+    build_parser.add_argument('output', help="輸出的 .npz")
+    build_parser.add_argument('moves', nargs='+', help="標記=影片 (或 p.py 的 .npz)")
+    build_parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+
+    classify_parser = subparsers.add_parser('classify', help="判斷影片中每一幀的姿勢")
+    classify_parser.add_argument('library', help="build 建立的 .npz")
+    classify_parser.add_argument('video', help="影片 (或 p.py 的 .npz)")
+    classify_parser.add_argument('--k', type=int, default=1, help="看最相似的幾個參考幀")
+    classify_parser.add_argument('--threshold', type=float, default=None, help="相似度低於這個值時不判斷")
+    classify_parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        library = pose_library()
+        for move in args.moves:
+            label, path = move.split('=', 1)
+            library.add_track(label, read_track(path, args.adjust))
+        library.save(args.output)
+        print(f"{args.output}: {len(library)} frames, {len(library.label_names)} labels")
+    else:
+        library = pose_library.load(args.library)
+        track = read_track(args.video, args.adjust)
+        start = time.perf_counter()
+        labels = [library.classify(points, args.k, args.threshold) if detected else None
+                  for points, detected in zip(track.landmarks, track.mask)]
+        elapsed = time.perf_counter() - start
+        for timestamp, label in zip(track.timestamps, labels):
+            print(f"{timestamp:7.2f}s  {label}")
+        print(f"{elapsed / max(len(labels), 1) * 1000:.3f} ms per frame")
@@ -0,0 +1,188 @@
+"""
+    分段評分
+    l.py 只把整段影片平均成三個數字，看不出是哪一段做得不好
+    先算出每一幀的相似度與每個關鍵點組的角度相似度，再用累積和 (cumsum) 算滑動視窗的平均
+    不論視窗多長，每個位置都只要兩個累積和相減，全部是 O(T)
+    輸出每一秒的分數、最差的幾段 (時間) 與那幾段中最差的關節
+    用法: python ab.py B3.mp4 B4.mp4 --window 1 --worst 5
+          python ab.py B3.npz B4.npz (p.py extract 輸出的 .npz)
+"""
+
+
+import argparse
+import json
+from collections import namedtuple
+import numpy as np
+from m import KEY_POINTS, KEY_POINT_NAMES, BODY_WEIGHTS, calculate_angles, joint_weights, weighted_similarity
+from p import extract_landmarks, load_landmarks, load_track, resample_track
+
+# 一段時間的分數
+segment_score = namedtuple('segment_score', [
+    'start',                # 開始時間 (秒)
+    'end',                  # 結束時間 (秒)
+    'frames',               # 這段時間內兩邊都有偵測到骨架的幀數
+    'average_similarity',   # 平均相似度，沒有可以比較的幀時為 None (JSON 沒有 NaN)
+    'joints'                # [(關鍵點組名稱, 角度相似度)]，由差到好排序
+])
+
+# 整段影片的報告
+segment_report = namedtuple('segment_report', [
+    'timeline',             # 每一秒的 segment_score
+    'worst',                # 最差的幾段 segment_score，彼此不重疊
+    'joints'                # 整段影片每個關鍵點組的角度相似度 [(名稱, 相似度)]，由差到好排序
+])
+
+
+# 逐幀配對兩段骨架座標 (T, 33, 4)
+# 回傳每一幀的平均相似度 (T,)、每個關鍵點組的角度相似度 (T, K)、valid (T,) 與每一組的 valid (T, K)
+# 關鍵點組的角度相似度為 100 * (1 - 角度差 / 180)，沒有偵測到骨架的幀為 0，valid 為 False
+# weights、min_visibility 見 m.py 的 joint_weights，被排除的組不列入，全部被排除的幀 valid 為 False
+def frame_scores(landmarks1, mask1, landmarks2, mask2, key_points=KEY_POINTS, weights=None, min_visibility=None):
+    frames = min(len(landmarks1), len(landmarks2))
+    valid = mask1[:frames] & mask2[:frames]
+    points1 = landmarks1[:frames][valid]
+    points2 = landmarks2[:frames][valid]
+
+    angles1, angles2 = calculate_angles(np.stack((points1, points2)), key_points)
+    average = np.zeros(frames)
+    average[valid] = weighted_similarity(points1, points2, key_points, weights, min_visibility)[2]
+    joints = np.zeros((frames, len(key_points)))
+    joints[valid] = 100 * (1 - np.abs(angles1 - angles2) / 180)
+    joint_valid = np.zeros((frames, len(key_points)), dtype=bool)
+    joint_valid[valid] = joint_weights(points1, points2, key_points, weights, min_visibility) > 0
+
+    valid &= ~np.isnan(average)
+    average[~valid] = 0
+    joint_valid &= valid[:, None]
+    return average, joints, valid, joint_valid
+
+
+# 沿著第一個維度，把 values 中 valid 的值分段平均，段落為 [starts[i], ends[i])
+# valid 可以是 (T,) 或與 values 相同的形狀 (例如每一組各自的 valid)
+# 用累積和算，每一段只要相減一次，沒有 valid 的幀的段落為 nan
+def range_mean(values, valid, starts, ends):
+    valid = valid.reshape(valid.shape + (1,) * (values.ndim - valid.ndim))
+    total = np.concatenate((np.zeros((1,) + values.shape[1:]), np.cumsum(values * valid, axis=0)))
+    count = np.concatenate((np.zeros((1,) + valid.shape[1:]), np.cumsum(valid, axis=0)))
+    counts = count[ends] - count[starts]
+    sums = total[ends] - total[starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return means, counts
+
+
+# 長度為 window 的滑動視窗平均，第 i 個為 [i, i + window) 的平均，O(T)
+def window_mean(values, valid, window):
+    window = max(min(window, len(values)), 1)
+    starts = np.arange(len(values) - window + 1)
+    return range_mean(values, valid, starts, starts + window)
+
+
+# 選出平均最低、彼此不重疊的 k 個視窗的開始位置，有效幀數少於 min_frames 的視窗不算
+def worst_windows(means, counts, window, k, min_frames=1):
+    order = np.argsort(np.where(counts >= min_frames, means, np.inf))
+    chosen = []
+    for start in order:
+        if len(chosen) == k or counts[start] < min_frames:
+            break
+        if all(abs(start - other) >= window for other in chosen):
+            chosen.append(int(start))
+    return chosen
+
+
+# 關鍵點組的相似度由差到好排序，nan (沒有資料) 不列入
+def rank_joints(scores, names=KEY_POINT_NAMES, top=None):
+    ranked = [(names[i], float(scores[i])) for i in np.argsort(scores) if not np.isnan(scores[i])]
+    return ranked[:top] if top else ranked
+
+
+# 產生分段報告，兩段骨架已經在同一個時間軸上 (幀率為 fps)
+# window: 找最差的段落時視窗的長度 (秒)，worst: 要找幾段，top_joints: 每一段列出幾個最差的關鍵點組
+# weights、min_visibility 見 m.py 的 joint_weights，與 l.py 的 --ignore-face、--min-visibility 相同
+def score_segments(landmarks1, mask1, landmarks2, mask2, fps, window=1.0, worst=5, top_joints=3,
+                   key_points=KEY_POINTS, names=KEY_POINT_NAMES, weights=None, min_visibility=None):
+    average, joints, valid, joint_valid = frame_scores(landmarks1, mask1, landmarks2, mask2, key_points,
+                                                       weights, min_visibility)
+    frames = len(valid)
+    if frames == 0:
+        return segment_report([], [], [])
+
+    # 每一秒
+    starts = np.round(np.arange(0, frames / fps, 1.0) * fps).astype(np.intp)
+    ends = np.append(starts[1:], frames)
+    second_means, second_counts = range_mean(average, valid, starts, ends)
+    second_joints, _ = range_mean(joints, joint_valid, starts, ends)
+    timeline = [segment_score(s / fps, e / fps, int(c), None if np.isnan(m) else float(m),
+                              rank_joints(j, names, top_joints))
+                for s, e, c, m, j in zip(starts, ends, second_counts, second_means, second_joints)]
+
+    # 最差的幾段，至少一半的幀要有偵測到骨架
+    size = max(min(int(round(window * fps)), frames), 1)
+    means, counts = window_mean(average, valid, size)
+    chosen = worst_windows(means, counts, size, worst, min_frames=max(size // 2, 1))
+    chosen_joints, _ = range_mean(joints, joint_valid, np.array(chosen, dtype=np.intp),
+                                  np.array(chosen, dtype=np.intp) + size)
+    worst_segments = [segment_score(s / fps, (s + size) / fps, int(counts[s]), float(means[s]),
+                                    rank_joints(j, names, top_joints))
+                      for s, j in zip(chosen, chosen_joints)]
+
+    overall_joints, _ = range_mean(joints, joint_valid, np.array([0]), np.array([frames]))
+    return segment_report(timeline, worst_segments, rank_joints(overall_joints[0], names))
+
+
+# 秒數寫成 分:秒
+def format_time(seconds):
+    return f"{int(seconds // 60)}:{seconds % 60:04.1f}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="segment-level similarity")
+    parser.add_argument('video1', nargs='?', default='B3.mp4', help="影片或 p.py extract 輸出的 .npz")
+    parser.add_argument('video2', nargs='?', default='B4.mp4', help="影片或 p.py extract 輸出的 .npz")
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--cache-dir', default=None, help="骨架座標快取資料夾 (見 p.py)")
+    parser.add_argument('--window', type=float, default=1.0, help="找最差段落時的視窗長度 (秒)")
+    parser.add_argument('--worst', type=int, default=5, help="列出幾段最差的段落")
+    parser.add_argument('--top-joints', type=int, default=3, help="每一段列出幾個最差的關鍵點組")
+    parser.add_argument('--ignore-face', action='store_true', help="臉的 5 組 (耳朵、眼睛、鼻子) 不列入相似度")
+    parser.add_argument('--min-visibility', type=float, default=None, help="visibility 不超過這個值的點所在的組不列入相似度")
+    parser.add_argument('--json', action='store_true', help="輸出 JSON")
+    args = parser.parse_args()
+
+    tracks = []
+    for video in (args.video1, args.video2):
+        if video.endswith('.npz'):
+            tracks.append(load_track(video))
+        elif args.cache_dir is not None:
+            tracks.append(load_landmarks(video, args.adjust, cache_dir=args.cache_dir))
+        else:
+            tracks.append(extract_landmarks(video, args.adjust))
+
+    # 幀率不同時，重新取樣到較低的幀率上再配對
+    fps = min(track.fps for track in tracks)
+    track1, track2 = (resample_track(track, fps) for track in tracks)
+    report = score_segments(track1.landmarks, track1.mask, track2.landmarks, track2.mask, fps,
+                            args.window, args.worst, args.top_joints,
+                            weights=BODY_WEIGHTS if args.ignore_face else None, min_visibility=args.min_visibility)
+
+    if args.json:
+        print(json.dumps({
+            'timeline': [segment._asdict() for segment in report.timeline],
+            'worst': [segment._asdict() for segment in report.worst],
+            'joints': report.joints,
+        }))
+    else:
+        print("timeline:")
+        for segment in report.timeline:
+            if segment.average_similarity is None:
+                print(f"  {format_time(segment.start)}       -   ({segment.frames} frames)")
+            else:
+                print(f"  {format_time(segment.start)}  {segment.average_similarity:6.2f}%  ({segment.frames} frames)")
+        print("worst segments:")
+        for segment in report.worst:
+            joints = ", ".join(f"{name} {score:.1f}%" for name, score in segment.joints)
+            print(f"  {format_time(segment.start)} - {format_time(segment.end)}  "
+                  f"{segment.average_similarity:6.2f}%  {joints}")
+        print("joints:")
+        for name, score in report.joints:
+            print(f"  {name:<36} {score:6.2f}%")
@@ -1,6 +1,7 @@
 """
     如何提取骨架做角度運算
     透過計算角度判斷目前姿勢
+    用很多標記好的參考幀判斷姿勢 (不必寫角度範圍) 見 aa.py
     https://hackmd.io/@am534143/r1pch8Y1p#%E4%BD%BF%E7%94%A8Mediapipe%E5%88%86%E6%9E%90%E5%8B%95%E4%BD%9C
 """
 
@@ -4,6 +4,7 @@
     分別生成骨架形狀
     目前不可用
     因為 mediapipe 不支援偵測多個人的骨架
+    多人模式見 z.py：先找出每個人再各自裁切偵測
 """
 
 
@@ -7,12 +7,21 @@
 """
 
 
+import argparse
+import json
+from collections import namedtuple
 import cv2
 import numpy as np
-import mediapipe as mp
+from m import KEY_POINTS, landmarks_to_array, calculate_angles, angle_similarity
+
+# headless 模式回傳的結果
+similarity_result = namedtuple('similarity_result', [
+    'frames',               # 兩個影片都有偵測到骨架的幀數
+    'average_similarity'    # 平均相似度
+])
 
 class skeleton_detection_similarity:
-    def __init__(self, video1, video2, adjust=3):
+    def __init__(self, video1, video2, adjust=3, headless=False):
         # 打開兩個影片
         self.cap1 = cv2.VideoCapture(video1)
         self.cap2 = cv2.VideoCapture(video2)
@@ -33,157 +42,149 @@ class skeleton_detection_similarity:
         # 將每一幀得相似度放進 list 中
         self.similarity_list = []
 
-        # mediapipe 初始設定
-        self.mp_drawing = mp.solutions.drawing_utils         # mediapipe 繪圖方法
-        self.mp_drawing_styles = mp.solutions.drawing_styles # mediapipe 繪圖樣式
-        self.mp_pose = mp.solutions.pose                     # mediapipe 姿勢偵測方法
-
-        # 定義需要比較的關鍵點組（如肩、肘、腕等）
-        self.key_points = [
-            (11, 13, 15),   # 左肩-左肘-左腕
-            (12, 14, 16),   # 右肩-右肘-右腕
-            (23, 25, 27),   # 左臀-左膝-左踝
-            (24, 26, 28),   # 右臀-右膝-右踝
-            (11, 23, 25),   # 左肩-左腰-左膝
-            (12, 24, 26),   # 右肩-右腰-右膝
-            (13, 15, 21),   # 左肘-左腕-左大拇指
-            (14, 16, 22),   # 右肘-右腕-右大拇指
-            (19, 15, 17),   # 左手-左腕-左小拇指
-            (20, 16, 18),   # 右手-右腕-右小拇指
-            (15, 17, 19),   # 左腕-左小拇指-左手
-            (16, 18, 20),   # 右腕-右小拇指-右手
-            (25, 27, 29),   # 左膝-左角踝-左腳跟
-            (26, 28, 30),   # 右膝-右角踝-右腳跟
-            (27, 29, 31),   # 左腳踝-左腳跟-左腳大拇指
-            (28, 30, 32),   # 右腳踝-右腳跟-右腳大拇指
-            (27, 31, 29),   # 左腳踝-左腳大拇指-左腳跟
-            (28, 32, 30),   # 右腳踝-右腳大拇指-右腳跟
-            (7,  3,  2 ),   # 左耳-左外眼角-左眼
-            (8,  6,  5 ),   # 右耳-右外眼角-右眼
-            (2,  1,  0 ),   # 左眼-左內眼角-鼻子
-            (5,  4,  0 ),   # 右眼-右內眼角-鼻子
-            (1,  0,  4 )    # 左內眼角-鼻子-右內眼角
-        ]
-
-    # 計算兩點之間的角度
-    def calculate_angle(self, p1, p2, p3):
-        a = np.array(p1) # First
-        b = np.array(p2) # Mid
-        c = np.array(p3) # End
-
-        # 使用arctan2()函式來進行運算，其得到之值為兩點之弧度，
-        radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
-        # 而求出兩個弧度後再作相減，再乘以pi，即可得到三點連線之角度。
-        angle = np.abs(radians * 180.0 / np.pi)
-        
-        if angle > 180.0:
-            angle = 360 - angle
-            
-        return angle
+        # headless 模式：不繪圖、不開視窗，只回傳結果
+        self.headless = headless
+
+        # 定義需要比較的關鍵點組（如肩、肘、腕等），內容見 m.py
+        self.key_points = KEY_POINTS
+
+    # mediapipe 載入要將近一秒，用到時才載入
+    # --help、headless 或只比對快取的時候不需要載入繪圖的部分
+    @property
+    def mp_drawing(self):
+        import mediapipe as mp
+        return mp.solutions.drawing_utils           # mediapipe 繪圖方法
+
+    @property
+    def mp_drawing_styles(self):
+        import mediapipe as mp
+        return mp.solutions.drawing_styles          # mediapipe 繪圖樣式
+
+    @property
+    def mp_pose(self):
+        import mediapipe as mp
+        return mp.solutions.pose                    # mediapipe 姿勢偵測方法
 
     # 比較兩個骨架的角度並計算相似度
     def calculate_similarity(self, landmarks1, landmarks2):
-        angles1 = []
-        angles2 = []
-        
-        for points in self.key_points:
-            p1_1 = [landmarks1[points[0]].x, landmarks1[points[0]].y]
-            p2_1 = [landmarks1[points[1]].x, landmarks1[points[1]].y]
-            p3_1 = [landmarks1[points[2]].x, landmarks1[points[2]].y]
-            
-            p1_2 = [landmarks2[points[0]].x, landmarks2[points[0]].y]
-            p2_2 = [landmarks2[points[1]].x, landmarks2[points[1]].y]
-            p3_2 = [landmarks2[points[2]].x, landmarks2[points[2]].y]
-            
-            angle1 = self.calculate_angle(p1_1, p2_1, p3_1)
-            angle2 = self.calculate_angle(p1_2, p2_2, p3_2)
-            
-            angles1.append(angle1)
-            angles2.append(angle2)
-        
-        angles1 = np.array(angles1)
-        angles2 = np.array(angles2)
-        
-        cosine_similarity = np.dot(angles1, angles2) / (np.linalg.norm(angles1) * np.linalg.norm(angles2))
-        similarity_percentage = cosine_similarity * 100
-        
-        return similarity_percentage
+        # 兩個骨架疊成 (2, 33, 4)，一次算出全部角度
+        points = np.stack((landmarks_to_array(landmarks1), landmarks_to_array(landmarks2)))
+        angles1, angles2 = calculate_angles(points, self.key_points)
+
+        return angle_similarity(angles1, angles2)
 
     def run(self):
         # 啟用姿勢偵測
+        # 每個影片各自使用一個 Pose，追蹤的 ROI 才不會被另一個影片打亂
         with self.mp_pose.Pose(
             min_detection_confidence=0.5,
-            min_tracking_confidence=0.5) as pose:
+            min_tracking_confidence=0.5) as pose1, \
+            self.mp_pose.Pose(
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5) as pose2:
 
             # 確認是否成功打開
             if not self.cap1.isOpened():
+                if self.headless:
+                    raise IOError("Cannot open camera1")
                 print("Cannot open camera1")
                 exit()
             if not self.cap2.isOpened():
+                if self.headless:
+                    raise IOError("Cannot open camera2")
                 print("Cannot open camera2")
                 exit()
 
+            # 預先配置好每一幀要用的 buffer，迴圈中不再配置新的陣列
+            # 合併的畫面只配置一次，分隔線也只畫一次，兩個影片直接縮小到畫面中各自的位置
+            combined_frame = np.zeros((max(self.resized_height1, self.resized_height2),
+                                       self.resized_width1 + 10 + self.resized_width2, 3), dtype=np.uint8)
+            combined_frame[:, self.resized_width1:self.resized_width1 + 10] = (0, 0, 255)  # 將分隔線設置為紅色
+            after1 = combined_frame[:self.resized_height1, :self.resized_width1]
+            after2 = combined_frame[:self.resized_height2, self.resized_width1 + 10:]
+            resized_frame1 = np.empty_like(after1)
+            resized_frame2 = np.empty_like(after2)
+
             while True:
                 ret1, frame1 = self.cap1.read()
                 ret2, frame2 = self.cap2.read()
                 if not ret1 or not ret2:
-                    print("Cannot receive frame")
+                    if not self.headless:
+                        print("Cannot receive frame")
                     break
                 
-                # 調整長寬
-                after1 = cv2.resize(frame1, (self.resized_width1, self.resized_height1))
-                after2 = cv2.resize(frame2, (self.resized_width2, self.resized_height2))
+                # 調整長寬，直接寫進合併畫面中的位置
+                cv2.resize(frame1, (self.resized_width1, self.resized_height1), dst=after1)
+                cv2.resize(frame2, (self.resized_width2, self.resized_height2), dst=after2)
+
+                cv2.cvtColor(after1, cv2.COLOR_BGR2RGB, dst=resized_frame1)   # 將 BGR 轉換成 RGB
+                results1 = pose1.process(resized_frame1)                     # 取得姿勢偵測結果
+                cv2.cvtColor(after2, cv2.COLOR_BGR2RGB, dst=resized_frame2)   # 將 BGR 轉換成 RGB
+                results2 = pose2.process(resized_frame2)                     # 取得姿勢偵測結果
+
+                # 如果兩個視頻都有檢測到骨架，計算相似度
+                if results1.pose_landmarks and results2.pose_landmarks:
+                    similarity_percentage = self.calculate_similarity(results1.pose_landmarks.landmark, results2.pose_landmarks.landmark)
+                    self.similarity_list.append(similarity_percentage)
+
+                # headless 模式不繪圖也不顯示
+                if self.headless:
+                    continue
 
-                resized_frame1 = cv2.cvtColor(after1, cv2.COLOR_BGR2RGB)   # 將 BGR 轉換成 RGB
-                results1 = pose.process(resized_frame1)                  # 取得姿勢偵測結果
                 # 根據姿勢偵測結果，標記身體節點和骨架
                 self.mp_drawing.draw_landmarks(
                     after1,
                     results1.pose_landmarks,
                     self.mp_pose.POSE_CONNECTIONS,
                     landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
-                
-                resized_frame2 = cv2.cvtColor(after2, cv2.COLOR_BGR2RGB)   # 將 BGR 轉換成 RGB
-                results2 = pose.process(resized_frame2)                  # 取得姿勢偵測結果
-                # 根據姿勢偵測結果，標記身體節點和骨架
                 self.mp_drawing.draw_landmarks(
                     after2,
                     results2.pose_landmarks,
                     self.mp_pose.POSE_CONNECTIONS,
                     landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
 
-                # 如果兩個視頻都有檢測到骨架，計算相似度
-                if results1.pose_landmarks and results2.pose_landmarks:
-                    similarity_percentage = self.calculate_similarity(results1.pose_landmarks.landmark, results2.pose_landmarks.landmark)
-                    self.similarity_list.append(similarity_percentage)
-
-
-                # 創建分隔線
-                separator = np.zeros((self.resized_height1, 10, 3), dtype=np.uint8)
-                separator[:] = (0, 0, 255)  # 將分隔線設置為紅色
-
-                # 合併兩個視頻到一個窗口中
-                combined_frame = np.hstack((after1, separator, after2))
-                
-                # 顯示調整後的視頻
+                # 兩個視頻已經在同一個畫面中，直接顯示
                 cv2.imshow('Combined Video', combined_frame)
 
                 # 按 'q' 鍵退出
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
 
+        # 釋放視頻對象
+        self.cap1.release()
+        self.cap2.release()
+
+        result = self.get_result()
+        if self.headless:
+            return result
 
         print("keypoint len:", len(self.key_points))
-        print("list len:", len(self.similarity_list))
+        print("list len:", result.frames)
         # 印出相似度
-        print(f"Average Similarity: {np.mean(self.similarity_list):.2f}%")
+        print(f"Average Similarity: {result.average_similarity:.2f}%")
     
-        # 釋放視頻對象並關閉所有窗口
-        self.cap1.release()
-        self.cap2.release()
+        # 關閉所有窗口
         cv2.destroyAllWindows()
+        return result
+
+    # 將目前累積的相似度整理成結果
+    def get_result(self):
+        return similarity_result(
+            frames=len(self.similarity_list),
+            average_similarity=float(np.mean(self.similarity_list)))
 
 
 if __name__ == '__main__':
-    sds = skeleton_detection_similarity('B3.mp4', 'B4.mp4')
-    sds.run()
+    parser = argparse.ArgumentParser(description="skeleton detection similarity")
+    parser.add_argument('video1', nargs='?', default='B3.mp4')
+    parser.add_argument('video2', nargs='?', default='B4.mp4')
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--headless', action='store_true', help="不繪圖也不顯示，只輸出結果 (JSON)")
+    args = parser.parse_args()
+
+    sds = skeleton_detection_similarity(args.video1, args.video2, args.adjust, headless=args.headless)
+    result = sds.run()
+    if args.headless:
+        # 沒有任何可以比較的幀時平均為 nan，JSON 沒有 NaN，改成 None (null)
+        print(json.dumps({key: None if isinstance(value, float) and np.isnan(value) else value
+                          for key, value in result._asdict().items()}))
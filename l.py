@@ -7,15 +7,69 @@
 """
 
 
+import argparse
+import contextlib
+import json
+import time
+from collections import namedtuple
 import cv2
 import numpy as np
-import mediapipe as mp
+from m import KEY_POINTS, BODY_WEIGHTS, landmarks_to_array, array_to_landmarks, weighted_similarity, track_similarity
+from p import extract_landmarks, load_landmarks, load_track, resample_track
+from q import align_tracks
+from r import frame_pairer, adaptive_sampler
+from s import similarity_stats
+from v import borrow
+from w import DECODERS, open_video, ffmpeg_available, latest_frame_reader
+from x import INFERENCE_WIDTHS, calibrate_inference_size
+from y import roi_tracker
+
+# 記錄花費時間的階段
+TIMING_STAGES = ('decode', 'resize', 'convert', 'pose', 'similarity', 'display')
+
+# headless 模式回傳的結果
+similarity_result = namedtuple('similarity_result', [
+    'frames',               # 兩個影片都有偵測到骨架的幀數
+    'angle_similarity',     # 平均角度相似度
+    'position_similarity',  # 平均位置相似度
+    'average_similarity'    # 兩者的平均
+])
+
+
+# 轉成輸出 JSON 用的 dict
+# 沒有任何可以比較的幀時平均為 nan，JSON 沒有 NaN，改成 None (null)
+def result_to_dict(result):
+    return {key: None if isinstance(value, float) and np.isnan(value) else value
+            for key, value in result._asdict().items()}
+
+
+# 依照寬度算出保持長寬比例的大小
+def scale_to_width(width, height, target_width):
+    return target_width, max(round(height * target_width / max(width, 1)), 1)
+
+
+# frame 的大小與 buffer 相同時直接回傳，否則縮小到 buffer 中
+def fit_frame(frame, buffer):
+    if frame.shape == buffer.shape:
+        return frame
+    return cv2.resize(frame, buffer.shape[1::-1], dst=buffer)
+
 
 class skeleton_detection_similarity:
-    def __init__(self, video1, video2, adjust=3):
+    def __init__(self, video1, video2, adjust=3, headless=False,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5, cache_dir=None, dtw_band=None,
+                 stride=1, target_fps=None, adaptive=False, decoder='opencv', decode_threads=0, hw_acceleration=False,
+                 inference_size=None, display_size=None, calibration_video=None, jitter_tolerance=0.1,
+                 roi=False, roi_margin=0.5, joint_weights=None, min_visibility=None,
+                 normalize_position=False, align_rotation=False, mirror=False):
+        self.video1 = video1
+        self.video2 = video2
+        self.adjust = adjust
+
         # 打開兩個影片
-        self.cap1 = cv2.VideoCapture(video1)
-        self.cap2 = cv2.VideoCapture(video2)
+        # decoder 為 ffmpeg 時在解碼時就縮小，decode_threads 與 hw_acceleration 見 w.py
+        self.cap1 = open_video(video1, decoder, adjust, decode_threads, hw_acceleration)
+        self.cap2 = open_video(video2, decoder, adjust, decode_threads, hw_acceleration)
 
         # 獲取第一個視頻的寬度和高度
         width1 = int(self.cap1.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -24,195 +78,583 @@ class skeleton_detection_similarity:
         width2 = int(self.cap2.get(cv2.CAP_PROP_FRAME_WIDTH))
         height2 = int(self.cap2.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-        # 設置調整後的寬度和高度（例如縮小一半）
-        self.resized_width1 = width1 // adjust
-        self.resized_height1 = height1 // adjust
-        self.resized_width2 = width2 // adjust
-        self.resized_height2 = height2 // adjust
-
-        # 將每一幀得相似度放進 list 中
-        self.angle_similarity_list = []
-        self.position_similarity_list = []
-        self.average_similarity_list = []
-
-        # mediapipe 初始設定
-        self.mp_drawing = mp.solutions.drawing_utils         # mediapipe 繪圖方法
-        self.mp_drawing_styles = mp.solutions.drawing_styles # mediapipe 繪圖樣式
-        self.mp_pose = mp.solutions.pose                     # mediapipe 姿勢偵測方法
-
-        # 定義需要比較的關鍵點組（如肩、肘、腕等）
-        self.key_points = [
-            (11, 13, 15),   # 左肩-左肘-左腕
-            (12, 14, 16),   # 右肩-右肘-右腕
-            (23, 25, 27),   # 左臀-左膝-左踝
-            (24, 26, 28),   # 右臀-右膝-右踝
-            (11, 23, 25),   # 左肩-左腰-左膝
-            (12, 24, 26),   # 右肩-右腰-右膝
-            (13, 15, 21),   # 左肘-左腕-左大拇指
-            (14, 16, 22),   # 右肘-右腕-右大拇指
-            (19, 15, 17),   # 左手-左腕-左小拇指
-            (20, 16, 18),   # 右手-右腕-右小拇指
-            (15, 17, 19),   # 左腕-左小拇指-左手
-            (16, 18, 20),   # 右腕-右小拇指-右手
-            (25, 27, 29),   # 左膝-左角踝-左腳跟
-            (26, 28, 30),   # 右膝-右角踝-右腳跟
-            (27, 29, 31),   # 左腳踝-左腳跟-左腳大拇指
-            (28, 30, 32),   # 右腳踝-右腳跟-右腳大拇指
-            (27, 31, 29),   # 左腳踝-左腳大拇指-左腳跟
-            (28, 32, 30),   # 右腳踝-右腳大拇指-右腳跟
-            (7,  3,  2 ),   # 左耳-左外眼角-左眼
-            (8,  6,  5 ),   # 右耳-右外眼角-右眼
-            (2,  1,  0 ),   # 左眼-左內眼角-鼻子
-            (5,  4,  0 ),   # 右眼-右內眼角-鼻子
-            (1,  0,  4 )    # 左內眼角-鼻子-右內眼角
-        ]
-
-    # 計算兩點之間的角度
-    def calculate_angle(self, p1, p2, p3):
-        a = np.array(p1) # First
-        b = np.array(p2) # Mid
-        c = np.array(p3) # End
-
-        # 使用arctan2()函式來進行運算，其得到之值為兩點之弧度，
-        radians = np.arctan2(c[1] - b[1], c[0] - b[0]) - np.arctan2(a[1] - b[1], a[0] - b[0])
-        # 而求出兩個弧度後再作相減，再乘以pi，即可得到三點連線之角度。
-        angle = np.abs(radians * 180.0 / np.pi)
-        
-        if angle > 180.0:
-            angle = 360 - angle
-            
-        return angle
+        # 設置調整後的寬度和高度（例如縮小一半），這是顯示的大小
+        # display_size 為顯示的寬度 (高度依照比例)，沒有設定時為原始大小除以 adjust
+        if display_size:
+            self.resized_width1, self.resized_height1 = scale_to_width(width1, height1, display_size)
+            self.resized_width2, self.resized_height2 = scale_to_width(width2, height2, display_size)
+        else:
+            self.resized_width1 = width1 // adjust
+            self.resized_height1 = height1 // adjust
+            self.resized_width2 = width2 // adjust
+            self.resized_height2 = height2 // adjust
+
+        # 送進 Pose 的大小：inference_size 為推論的寬度，沒有設定時與顯示的大小相同
+        # 'auto' 時在 run() 開始前用 calibration_video (預設為 video1) 校正出抖動不會變大的最小寬度 (見 x.py)
+        self.source_sizes = ((width1, height1), (width2, height2))
+        # 兩個影片的寬 / 高，正規化位置時把 x 換成與 y 相同的單位 (見 m.py 的 normalize_pose)
+        # 參考是 .npz 等拿不到大小時用另一個影片的比例
+        aspects = [width / height if width > 0 and height > 0 else None for width, height in self.source_sizes]
+        self.aspects = tuple(aspect or next((other for other in aspects if other), 1.0) for aspect in aspects)
+        self.inference_size = inference_size
+        self.calibration_video = calibration_video or video1
+        self.jitter_tolerance = jitter_tolerance
+        self.calibration = None
+        self.set_inference_size(None if inference_size == 'auto' else inference_size)
+
+        # 人物裁切：用上一幀骨架的範圍加上 roi_margin 倍的邊界裁切原始的幀再送進 Pose (見 y.py)
+        self.roi = roi
+        self.roi_margin = roi_margin
+
+        # 每一幀的相似度放進串流統計中，記憶體固定，執行中也可以查詢 (見 s.py)
+        self.angle_stats = similarity_stats()
+        self.position_stats = similarity_stats()
+        self.average_stats = similarity_stats()
+
+        # headless 模式：不繪圖、不開視窗，只回傳結果
+        self.headless = headless
+
+        # run() 中每個階段累計花費的秒數與處理的幀數
+        self.timings = dict.fromkeys(TIMING_STAGES, 0.0)
+        self.timed_frames = 0
+        self.lap_start = 0.0
+
+        # 姿勢偵測的信心值
+        self.min_detection_confidence = min_detection_confidence
+        self.min_tracking_confidence = min_tracking_confidence
+
+        # 骨架座標快取資料夾，None 表示不使用快取 (見 p.py)
+        self.cache_dir = cache_dir
+
+        # DTW 對齊時對角線左右可以偏移的幀數，None 表示逐幀配對 (見 q.py)
+        self.dtw_band = dtw_band
+        self.warping_path = None
+
+        # 取樣方式 (見 r.py)
+        # stride: 每幾幀取一幀，target_fps: 取樣的幀率
+        # adaptive: 動作變化小時取樣變稀疏，變化大時恢復每幀取樣
+        self.stride = stride
+        self.target_fps = target_fps
+        self.adaptive = adaptive
+
+        # 定義需要比較的關鍵點組（如肩、肘、腕等），內容見 m.py
+        self.key_points = KEY_POINTS
+
+        # 每個關鍵點組的權重 (例如 m.py 的 BODY_WEIGHTS 不看臉)，None 表示全部相同
+        # min_visibility: 任一個骨架中 visibility 不超過這個值的點所在的組不列入，None 表示不看 visibility
+        self.joint_weights = joint_weights
+        self.min_visibility = min_visibility
+
+        # 位置相似度先以臀部為中心、軀幹長度為單位正規化，站的位置、離鏡頭遠近不同也可以比較 (見 m.py)
+        # align_rotation: 再轉到最接近的角度，mirror: 左右相反的動作也算相同
+        self.normalize_position = normalize_position
+        self.align_rotation = align_rotation
+        self.mirror = mirror
+
+    # mediapipe 載入要將近一秒，用到時才載入
+    # --help、headless 或只比對快取的時候不需要載入繪圖的部分
+    @property
+    def mp_drawing(self):
+        import mediapipe as mp
+        return mp.solutions.drawing_utils           # mediapipe 繪圖方法
+
+    @property
+    def mp_drawing_styles(self):
+        import mediapipe as mp
+        return mp.solutions.drawing_styles          # mediapipe 繪圖樣式
+
+    @property
+    def mp_pose(self):
+        import mediapipe as mp
+        return mp.solutions.pose                    # mediapipe 姿勢偵測方法
 
     # 比較兩個骨架的角度並計算相似度
+    # 兩個骨架疊成 (2, 33, 4)，一次算出全部角度，再依照權重與 visibility 計算角度、位置 (1 減去平均歐氏距離) 與兩者的平均
+    # 看不清楚的點太多、沒有任何一組可以比較時為 nan，add_similarity 不會列入
     def calculate_similarity(self, landmarks1, landmarks2):
-        angles1 = []
-        angles2 = []
-        distances = []
-        
-        for points in self.key_points:
-            p1_1 = [landmarks1[points[0]].x, landmarks1[points[0]].y]
-            p2_1 = [landmarks1[points[1]].x, landmarks1[points[1]].y]
-            p3_1 = [landmarks1[points[2]].x, landmarks1[points[2]].y]
-            
-            p1_2 = [landmarks2[points[0]].x, landmarks2[points[0]].y]
-            p2_2 = [landmarks2[points[1]].x, landmarks2[points[1]].y]
-            p3_2 = [landmarks2[points[2]].x, landmarks2[points[2]].y]
-            
-            # 計算角度相似度
-            angle1 = self.calculate_angle(p1_1, p2_1, p3_1)
-            angle2 = self.calculate_angle(p1_2, p2_2, p3_2)
-            
-            angles1.append(angle1)
-            angles2.append(angle2)
-
-            # 計算 XYZ 位置相似度
-            for idx in points:
-                point1 = landmarks1[idx]
-                point2 = landmarks2[idx]
-
-                # 歐氏距離計算
-                distance = np.sqrt(
-                    (point1.x - point2.x) ** 2 + 
-                    (point1.y - point2.y) ** 2 + 
-                    (point1.z - point2.z) ** 2
-                )
-                distances.append(distance)
-        
-        # 計算角度相似度
-        angles1 = np.array(angles1)
-        angles2 = np.array(angles2)
-        
-        cosine_similarity = np.dot(angles1, angles2) / (np.linalg.norm(angles1) * np.linalg.norm(angles2))
-        angle_similarity_percentage = cosine_similarity * 100
-
-        # 計算位置相似度 (平均距離的倒數)
-        avg_distance = np.mean(distances)
-        position_similarity_percentage = (1 - avg_distance) * 100
-
-        # 計算兩者的平均相似度
-        average_similarity = (angle_similarity_percentage + position_similarity_percentage) / 2
-        
-        return angle_similarity_percentage, position_similarity_percentage, average_similarity
-
-    def run(self):
+        points1 = landmarks_to_array(landmarks1)
+        points2 = landmarks_to_array(landmarks2)
+        return weighted_similarity(points1, points2, self.key_points, self.joint_weights, self.min_visibility,
+                                   self.normalize_position, self.align_rotation, self.mirror, self.aspects)
+
+    # 把解碼後的幀整理成姿勢偵測用的 RGB，回傳要交給 Pose 的影像與裁切的範圍 (見 y.py，沒有裁切時為 None)
+    # rgb: 預先配置的 RGB buffer (推論的大小)，display: 合併畫面中這個影片的位置 (BGR，顯示的大小)，headless 時為 None
+    # roi: 有的話只把人物附近的區域送進 Pose，顯示的還是整張畫面
+    # 推論與顯示的大小可以不同，landmark 是相對座標，畫在顯示的畫面上時會自動對應到顯示的大小
+    def prepare_frame(self, frame, rgb, display, roi=None):
+        crop, box = roi.crop(frame) if roi is not None else (frame, None)
+
+        # 顯示時先縮小到畫面中，推論與顯示的是同一張、同樣大小時直接從畫面轉換一份 RGB 給 Pose，畫面保留 BGR 用來繪圖
+        # 其他情況縮小到 rgb 後原地轉換 (已經是推論的大小就直接轉換到 rgb)
+        if display is not None:
+            cv2.resize(frame, display.shape[1::-1], dst=display)
+            if box is None and display.shape == rgb.shape:
+                crop = display
+        source = fit_frame(crop, rgb)
+        self.lap('resize')
+        cv2.cvtColor(source, cv2.COLOR_BGR2RGB, dst=rgb)
+        self.lap('convert')
+        return rgb, box
+
+    # 取出姿勢偵測結果的 landmark (33, 4)，沒有偵測到時回傳 None
+    # 有裁切時換算回整張畫面的座標，並更新下一幀的裁切範圍
+    def read_landmarks(self, results, roi=None, box=None):
+        if not results.pose_landmarks:
+            if roi is not None:
+                roi.update(None)
+            return None
+        points = landmarks_to_array(results.pose_landmarks.landmark)
+        if box is not None:
+            roi.to_frame(points, box)
+            # 畫在整張畫面上時也要用換算後的座標
+            if not self.headless:
+                array_to_landmarks(points, results.pose_landmarks.landmark)
+        if roi is not None:
+            roi.update(points)
+        return points
+
+    # 設定推論的寬度，None 表示與顯示的大小相同
+    def set_inference_size(self, width):
+        if width:
+            self.inference_width1, self.inference_height1 = scale_to_width(*self.source_sizes[0], width)
+            self.inference_width2, self.inference_height2 = scale_to_width(*self.source_sizes[1], width)
+        else:
+            self.inference_width1, self.inference_height1 = self.resized_width1, self.resized_height1
+            self.inference_width2, self.inference_height2 = self.resized_width2, self.resized_height2
+
+    # 把上一次呼叫到現在的時間算在 stage 這個階段
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] += now - self.lap_start
+        self.lap_start = now
+
+    # 每個階段平均每一組幀花費的毫秒數
+    def timing_report(self):
+        frames = max(self.timed_frames, 1)
+        return {stage: seconds / frames * 1000 for stage, seconds in self.timings.items()}
+
+    # pose1, pose2: 外部已經建立好的 Pose，沒有給的話從 Pose 共用池借 (見 v.py)
+    # timeout: 最多執行幾秒，超過時丟出 TimeoutError
+    def run(self, pose1=None, pose2=None, timeout=None):
+        if self.cache_dir is not None or self.dtw_band is not None:
+            return self.run_tracks()
+
+        deadline = time.monotonic() + timeout if timeout else None
+
         # 啟用姿勢偵測
-        with self.mp_pose.Pose(
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5) as pose:
+        # 每個影片各自使用一個 Pose，追蹤的 ROI 才不會被另一個影片打亂
+        # 從共用池借來的 Pose 在結束時清掉追蹤狀態並歸還，下一次不必重新載入模型
+        with contextlib.ExitStack() as stack:
+            if pose1 is None:
+                pose1 = stack.enter_context(borrow(
+                    min_detection_confidence=self.min_detection_confidence,
+                    min_tracking_confidence=self.min_tracking_confidence))
+            if pose2 is None:
+                pose2 = stack.enter_context(borrow(
+                    min_detection_confidence=self.min_detection_confidence,
+                    min_tracking_confidence=self.min_tracking_confidence))
 
             # 確認是否成功打開
             if not self.cap1.isOpened():
+                if self.headless:
+                    raise IOError("Cannot open camera1")
                 print("Cannot open camera1")
                 exit()
             if not self.cap2.isOpened():
+                if self.headless:
+                    raise IOError("Cannot open camera2")
                 print("Cannot open camera2")
                 exit()
 
+            # 自動選擇推論的大小，同一個物件只校正一次
+            if self.inference_size == 'auto' and self.calibration is None:
+                self.calibration = calibrate_inference_size(
+                    self.calibration_video, tolerance=self.jitter_tolerance,
+                    min_detection_confidence=self.min_detection_confidence,
+                    min_tracking_confidence=self.min_tracking_confidence)
+                self.set_inference_size(self.calibration.width)
+                if not self.headless:
+                    print(f"inference width: {self.calibration.width}")
+
+            # 依照時間配對兩個影片的幀，幀率不同時以較低的為準
+            # 跳過的幀只 grab()，不會解碼也不會做姿勢偵測
+            pairer = frame_pairer(self.cap1, self.cap2, self.target_fps, self.stride)
+            sampler = adaptive_sampler(min_step=self.stride) if self.adaptive else None
+
+            # 預先配置好每一幀要用的 buffer，迴圈中不再配置新的陣列
+            # 合併的畫面只配置一次，分隔線也只畫一次，兩個影片直接縮小到畫面中各自的位置
+            combined_frame = np.zeros((max(self.resized_height1, self.resized_height2),
+                                       self.resized_width1 + 10 + self.resized_width2, 3), dtype=np.uint8)
+            combined_frame[:, self.resized_width1:self.resized_width1 + 10] = (0, 0, 255)  # 將分隔線設置為紅色
+            after1 = combined_frame[:self.resized_height1, :self.resized_width1]
+            after2 = combined_frame[:self.resized_height2, self.resized_width1 + 10:]
+            resized_frame1 = np.empty((self.inference_height1, self.inference_width1, 3), dtype=np.uint8)
+            resized_frame2 = np.empty((self.inference_height2, self.inference_width2, 3), dtype=np.uint8)
+            display1 = None if self.headless else after1
+            display2 = None if self.headless else after2
+
+            # 人物裁切，裁切區域的比例與推論的大小相同 (見 y.py)
+            roi1 = roi_tracker(self.roi_margin, self.inference_width1 / self.inference_height1) if self.roi else None
+            roi2 = roi_tracker(self.roi_margin, self.inference_width2 / self.inference_height2) if self.roi else None
+
+            self.timings = dict.fromkeys(TIMING_STAGES, 0.0)
+            self.timed_frames = 0
+            self.lap_start = time.perf_counter()
             while True:
-                ret1, frame1 = self.cap1.read()
-                ret2, frame2 = self.cap2.read()
-                if not ret1 or not ret2:
-                    print("Cannot receive frame")
+                ret, frame1, frame2 = pairer.read()
+                if not ret:
+                    if not self.headless:
+                        print("Cannot receive frame")
                     break
+                self.timed_frames += 1
+                self.lap('decode')
+
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"run() took more than {timeout} seconds")
                 
-                # 調整長寬
-                after1 = cv2.resize(frame1, (self.resized_width1, self.resized_height1))
-                after2 = cv2.resize(frame2, (self.resized_width2, self.resized_height2))
+                # 調整成推論的大小並轉換成 RGB，顯示時另外縮小成顯示的大小直接寫進合併畫面中的位置
+                rgb1, box1 = self.prepare_frame(frame1, resized_frame1, display1, roi1)
+                rgb2, box2 = self.prepare_frame(frame2, resized_frame2, display2, roi2)
+                # 裁切範圍移動時，Pose 內部上一幀的追蹤位置對不上新的座標，reset 後這一幀重新偵測
+                if self.roi:
+                    if roi1.moved:
+                        pose1.reset()
+                    if roi2.moved:
+                        pose2.reset()
+
+                results1 = pose1.process(rgb1)                  # 取得姿勢偵測結果
+                results2 = pose2.process(rgb2)                  # 取得姿勢偵測結果
+                self.lap('pose')
+
+                points1 = self.read_landmarks(results1, roi1, box1)
+                points2 = self.read_landmarks(results2, roi2, box2)
+                detected = points1 is not None and points2 is not None
+
+                # 自適應取樣：依照動作變化的大小決定下一次要跳過幾幀
+                if sampler is not None:
+                    pairer.step = sampler.update(np.stack((points1, points2)) if detected else None, pairer.gap)
+
+                # 如果兩個視頻都有檢測到骨架，計算相似度
+                # 這一幀代表與上一次取樣之間實際相隔的 pairer.gap 幀
+                if detected:
+                    self.add_similarity(*self.calculate_similarity(points1, points2), weight=pairer.gap)
+                self.lap('similarity')
+
+                # headless 模式不繪圖也不顯示
+                if self.headless:
+                    continue
 
-                resized_frame1 = cv2.cvtColor(after1, cv2.COLOR_BGR2RGB)   # 將 BGR 轉換成 RGB
-                results1 = pose.process(resized_frame1)                  # 取得姿勢偵測結果
                 # 根據姿勢偵測結果，標記身體節點和骨架
+                # 合併畫面是 BGR，繪圖的顏色也是 BGR
                 self.mp_drawing.draw_landmarks(
                     after1,
                     results1.pose_landmarks,
                     self.mp_pose.POSE_CONNECTIONS,
                     landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
-                
-                resized_frame2 = cv2.cvtColor(after2, cv2.COLOR_BGR2RGB)   # 將 BGR 轉換成 RGB
-                results2 = pose.process(resized_frame2)                  # 取得姿勢偵測結果
-                # 根據姿勢偵測結果，標記身體節點和骨架
                 self.mp_drawing.draw_landmarks(
                     after2,
                     results2.pose_landmarks,
                     self.mp_pose.POSE_CONNECTIONS,
                     landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
 
-                # 如果兩個視頻都有檢測到骨架，計算相似度
-                if results1.pose_landmarks and results2.pose_landmarks:
-                    angle_similarity, position_similarity, average_similarity = self.calculate_similarity(results1.pose_landmarks.landmark, results2.pose_landmarks.landmark)
-                    self.angle_similarity_list.append(angle_similarity)
-                    self.position_similarity_list.append(position_similarity)
-                    self.average_similarity_list.append(average_similarity)
-
-
-                # 創建分隔線
-                separator = np.zeros((self.resized_height1, 10, 3), dtype=np.uint8)
-                separator[:] = (0, 0, 255)  # 將分隔線設置為紅色
-
-                # 合併兩個視頻到一個窗口中
-                combined_frame = np.hstack((after1, separator, after2))
-                
-                # 顯示調整後的視頻
+                # 兩個視頻已經在同一個畫面中，直接顯示
                 cv2.imshow('Combined Video', combined_frame)
 
                 # 按 'q' 鍵退出
-                if cv2.waitKey(1) & 0xFF == ord('q'):
+                key = cv2.waitKey(1) & 0xFF
+                self.lap('display')
+                if key == ord('q'):
                     break
 
+        # 釋放視頻對象
+        self.cap1.release()
+        self.cap2.release()
+
+        result = self.get_result()
+        if self.headless:
+            return result
 
         print("keypoint len:", len(self.key_points))
-        print("list len:", len(self.angle_similarity_list))
+        print("list len:", result.frames)
         # 印出相似度
-        print(f"Average Angle Similarity: {np.mean(self.angle_similarity_list):.2f}%")
-        print(f"Average Position Similarity: {np.mean(self.position_similarity_list):.2f}%")
-        print(f"Overall Average Similarity: {np.mean(self.average_similarity_list):.2f}%")
+        print(f"Average Angle Similarity: {result.angle_similarity:.2f}%")
+        print(f"Average Position Similarity: {result.position_similarity:.2f}%")
+        print(f"Overall Average Similarity: {result.average_similarity:.2f}%")
+        print("ms per frame: " + ", ".join(f"{stage} {ms:.2f}" for stage, ms in self.timing_report().items()))
     
-        # 釋放視頻對象並關閉所有窗口
+        # 關閉所有窗口
+        cv2.destroyAllWindows()
+        return result
+
+    # 先取得兩個影片全部的骨架座標，再一次算完所有幀的相似度
+    # 有設定 cache_dir 時從快取讀取，沒有快取的影片會先偵測一次並存起來
+    # 有設定 dtw_band 時用 DTW 對齊後再比較，否則逐幀配對
+    # 這個模式不開視窗
+    def run_tracks(self):
         self.cap1.release()
         self.cap2.release()
+
+        tracks = []
+        for video in (self.video1, self.video2):
+            if self.cache_dir is not None:
+                tracks.append(load_landmarks(video, self.adjust, self.min_detection_confidence,
+                                             self.min_tracking_confidence, self.cache_dir))
+            else:
+                tracks.append(extract_landmarks(video, self.adjust, self.min_detection_confidence,
+                                                self.min_tracking_confidence))
+        track1, track2 = tracks
+
+        # 幀率不同時，重新取樣到較低的幀率上再配對
+        fps = min(track1.fps, track2.fps)
+        if self.target_fps:
+            fps = min(fps, self.target_fps)
+        fps /= self.stride
+        track1 = resample_track(track1, fps)
+        track2 = resample_track(track2, fps)
+
+        if self.dtw_band is not None:
+            # 沿著 DTW 的路徑配對
+            aligned = align_tracks(track1.landmarks, track1.mask, track2.landmarks, track2.mask,
+                                   self.dtw_band, self.key_points, self.joint_weights, self.min_visibility)
+            self.warping_path = aligned.path
+            track1 = track1._replace(landmarks=track1.landmarks[aligned.path[:, 0]], mask=track1.mask[aligned.path[:, 0]])
+            track2 = track2._replace(landmarks=track2.landmarks[aligned.path[:, 1]], mask=track2.mask[aligned.path[:, 1]])
+
+        # 逐幀配對，只比較兩個影片都有偵測到骨架的幀
+        self.add_similarity(*track_similarity(
+            track1.landmarks, track1.mask, track2.landmarks, track2.mask, self.key_points,
+            self.joint_weights, self.min_visibility, self.normalize_position, self.align_rotation, self.mirror,
+            self.aspects))
+
+        result = self.get_result()
+        if not self.headless:
+            print("keypoint len:", len(self.key_points))
+            print("list len:", result.frames)
+            # 印出相似度
+            print(f"Average Angle Similarity: {result.angle_similarity:.2f}%")
+            print(f"Average Position Similarity: {result.position_similarity:.2f}%")
+            print(f"Overall Average Similarity: {result.average_similarity:.2f}%")
+        return result
+
+    # 即時模式：攝影機 (video2) 與事先偵測好的參考骨架 (p.py 的 landmark_track) 比較
+    # 攝影機在另一個執行緒讀取，只處理最新的一幀，來不及處理的幀直接丟掉，延遲不會累積 (見 w.py)
+    # 攝影機的每一幀依照讀到的時間對應到參考骨架的同一個時間點，處理得慢也不會對不上
+    # latency_target: 從讀到一幀到顯示完成的目標秒數，最近的平均超過時把推論的寬度降一級 (見 x.py)，
+    #                 低於一半時再升回來，最大為原本設定的推論寬度
+    # loop: 參考骨架結束後從頭開始，否則結束；timeout: 最多執行幾秒
+    # pace: video2 是影片檔時依照影片的時間讀取，用來模擬攝影機
+    def run_live(self, reference, latency_target=0.1, loop=False, timeout=None, pose=None, pace=False):
+        self.cap1.release()
+        if not self.cap2.isOpened():
+            if self.headless:
+                raise IOError("Cannot open camera2")
+            print("Cannot open camera2")
+            exit()
+
+        # 推論寬度可以調整的範圍，從目前的寬度開始
+        widths = [width for width in INFERENCE_WIDTHS if width < self.inference_width2] + [self.inference_width2]
+        level = len(widths) - 1
+        changed_at = 0
+
+        display = None
+        if not self.headless:
+            display = np.empty((self.resized_height2, self.resized_width2, 3), dtype=np.uint8)
+        resized_frame = np.empty((self.inference_height2, self.inference_width2, 3), dtype=np.uint8)
+
+        # 延遲 (毫秒) 也用串流統計，記憶體固定
+        self.latency_stats = similarity_stats(low=0.0, high=2000.0, bins=4000)
+        self.timings = dict.fromkeys(TIMING_STAGES, 0.0)
+        self.timed_frames = 0
+
+        with contextlib.ExitStack() as stack:
+            # Pose 建立好之後才開始讀取攝影機，載入模型的時間不算在延遲中
+            if pose is None:
+                pose = stack.enter_context(borrow(
+                    min_detection_confidence=self.min_detection_confidence,
+                    min_tracking_confidence=self.min_tracking_confidence))
+            reader = latest_frame_reader(self.cap2, pace)
+            start = None
+            deadline = time.monotonic() + timeout if timeout else None
+            try:
+                while True:
+                    ret, frame, captured_at = reader.read()
+                    if not ret:
+                        if not self.headless:
+                            print("Cannot receive frame")
+                        break
+                    if deadline is not None and time.monotonic() > deadline:
+                        break
+                    self.lap_start = time.perf_counter()
+                    self.timed_frames += 1
+
+                    # 依照讀到這一幀的時間對應參考骨架的幀
+                    if start is None:
+                        start = captured_at
+                    index = int((captured_at - start) * reference.fps)
+                    if index >= len(reference.mask):
+                        if not loop:
+                            break
+                        index %= len(reference.mask)
+
+                    rgb, _ = self.prepare_frame(frame, resized_frame, display)
+                    results = pose.process(rgb)
+                    self.lap('pose')
+
+                    points = self.read_landmarks(results)
+                    if points is not None and reference.mask[index]:
+                        self.add_similarity(*self.calculate_similarity(reference.landmarks[index], points))
+                    self.lap('similarity')
+
+                    if not self.headless:
+                        self.mp_drawing.draw_landmarks(
+                            display,
+                            results.pose_landmarks,
+                            self.mp_pose.POSE_CONNECTIONS,
+                            landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
+                        cv2.putText(display, f"{self.average_stats.window_mean():.1f}%  "
+                                             f"{self.latency_stats.window_mean():.0f} ms",
+                                    (10, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                        cv2.imshow('Live', display)
+                        key = cv2.waitKey(1) & 0xFF
+                        self.lap('display')
+                        if key == ord('q'):
+                            break
+
+                    self.latency_stats.add((time.perf_counter() - captured_at) * 1000)
+
+                    # 延遲超過目標時降低推論的寬度，遠低於目標時再升回來
+                    # 調整後等最近的平均都是新的寬度再判斷
+                    if latency_target and self.timed_frames - changed_at >= self.latency_stats.recent.maxlen:
+                        recent = self.latency_stats.window_mean() / 1000
+                        if recent > latency_target and level > 0:
+                            level -= 1
+                        elif recent < latency_target / 2 and level < len(widths) - 1:
+                            level += 1
+                        else:
+                            continue
+                        changed_at = self.timed_frames
+                        self.inference_width2, self.inference_height2 = scale_to_width(
+                            *self.source_sizes[1], widths[level])
+                        resized_frame = np.empty((self.inference_height2, self.inference_width2, 3), dtype=np.uint8)
+            finally:
+                reader.release()
+        self.dropped_frames = reader.dropped
+
+        result = self.get_result()
+        if self.headless:
+            return result
+
+        print(f"Overall Average Similarity: {result.average_similarity:.2f}%")
+        print(f"latency ms: p50 {self.latency_stats.percentile(50):.1f}, p90 {self.latency_stats.percentile(90):.1f}, "
+              f"p99 {self.latency_stats.percentile(99):.1f}, dropped frames {reader.dropped}, "
+              f"inference width {self.inference_width2}")
         cv2.destroyAllWindows()
+        return result
+
+    # 延遲的百分位數 (毫秒) 與丟掉的幀數，run_live() 之後才有，一幀都沒有處理時百分位數為 None
+    def latency_report(self):
+        if self.latency_stats.count == 0:
+            return {'p50': None, 'p90': None, 'p99': None, 'max': None, 'dropped': self.dropped_frames}
+        return {
+            'p50': self.latency_stats.percentile(50),
+            'p90': self.latency_stats.percentile(90),
+            'p99': self.latency_stats.percentile(99),
+            'max': float(self.latency_stats.max),
+            'dropped': self.dropped_frames,
+        }
+
+    # 記錄一幀 (或一批幀) 的相似度，weight 為這一幀代表的幀數 (跳幀取樣時用來加權平均)
+    # 沒有任何一組可以比較的幀 (nan) 不列入，一批幀時只去掉 nan 的幀
+    def add_similarity(self, angle_similarity, position_similarity, average_similarity, weight=1):
+        keep = ~np.isnan(average_similarity)
+        if not np.all(keep):
+            keep = np.atleast_1d(keep)
+            angle_similarity = np.atleast_1d(angle_similarity)[keep]
+            position_similarity = np.atleast_1d(position_similarity)[keep]
+            average_similarity = np.atleast_1d(average_similarity)[keep]
+            weight = np.broadcast_to(weight, keep.shape)[keep]
+        self.angle_stats.add(angle_similarity, weight)
+        self.position_stats.add(position_similarity, weight)
+        self.average_stats.add(average_similarity, weight)
+
+    # 將目前累積的相似度整理成結果，執行中也可以呼叫
+    def get_result(self):
+        return similarity_result(
+            frames=self.average_stats.count,
+            angle_similarity=float(self.angle_stats.mean),
+            position_similarity=float(self.position_stats.mean),
+            average_similarity=float(self.average_stats.mean))
 
 
 if __name__ == '__main__':
-    sds = skeleton_detection_similarity('B3.mp4', 'B4.mp4')
-    sds.run()
+    parser = argparse.ArgumentParser(description="skeleton detection similarity")
+    parser.add_argument('video1', nargs='?', default='B3.mp4')
+    parser.add_argument('video2', nargs='?', default='B4.mp4')
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--headless', action='store_true', help="不繪圖也不顯示，只輸出結果 (JSON)")
+    parser.add_argument('--cache-dir', default=None, help="骨架座標快取資料夾，設定後從快取比對而不開視窗")
+    parser.add_argument('--dtw-band', type=int, default=None, help="用 DTW 對齊兩個影片，對角線左右可以偏移的幀數")
+    parser.add_argument('--stride', type=int, default=1, help="每幾幀取一幀做偵測")
+    parser.add_argument('--target-fps', type=float, default=None, help="取樣的幀率")
+    parser.add_argument('--adaptive', action='store_true', help="動作變化小時取樣變稀疏，變化大時恢復每幀取樣")
+    parser.add_argument('--decoder', choices=DECODERS, default='opencv', help="解碼方式，ffmpeg 會在解碼時就縮小")
+    parser.add_argument('--decode-threads', type=int, default=0, help="解碼執行緒數量，0 表示自動")
+    parser.add_argument('--hw-accel', action='store_true', help="有支援的話使用硬體解碼")
+    parser.add_argument('--inference-size', default=None, help="送進 Pose 的寬度，auto 為自動校正，預設與顯示的大小相同")
+    parser.add_argument('--display-size', type=int, default=None, help="顯示的寬度，預設為原始大小除以 adjust")
+    parser.add_argument('--calibration-video', default=None, help="自動校正用的影片，預設為 video1")
+    parser.add_argument('--jitter-tolerance', type=float, default=0.1, help="自動校正時 landmark 抖動最多可以比最大寬度多幾成")
+    parser.add_argument('--roi', action='store_true', help="只把上一幀人物附近的區域送進 Pose")
+    parser.add_argument('--roi-margin', type=float, default=0.5, help="人物範圍四周加上的邊界 (範圍大小的倍數)")
+    parser.add_argument('--ignore-face', action='store_true', help="臉的 5 組 (耳朵、眼睛、鼻子) 不列入相似度")
+    parser.add_argument('--joint-weights', default=None, help="每個關鍵點組的權重，以逗號分隔的 23 個數字 (順序見 m.py)")
+    parser.add_argument('--min-visibility', type=float, default=None, help="visibility 不超過這個值的點所在的組不列入相似度")
+    parser.add_argument('--normalize-position', action='store_true', help="位置相似度以臀部為中心、軀幹長度為單位比較")
+    parser.add_argument('--align-rotation', action='store_true', help="正規化位置時再轉到最接近的角度 (需要 --normalize-position)")
+    parser.add_argument('--mirror', action='store_true', help="正規化位置時左右相反的動作也算相同 (需要 --normalize-position)")
+    parser.add_argument('--live', action='store_true', help="即時模式：video2 為攝影機編號 (或影片)，video1 為參考影片或 p.py 存的 .npz")
+    parser.add_argument('--latency-target', type=float, default=0.1, help="即時模式的目標延遲 (秒)，0 表示不調整推論的寬度")
+    parser.add_argument('--loop', action='store_true', help="即時模式中參考骨架結束後從頭開始")
+    parser.add_argument('--pace', action='store_true', help="即時模式中 video2 為影片時依照影片的時間讀取")
+    args = parser.parse_args()
+    if args.inference_size not in (None, 'auto'):
+        args.inference_size = int(args.inference_size)
+    if args.decoder == 'ffmpeg' and not ffmpeg_available():
+        parser.error("--decoder ffmpeg needs ffmpeg on PATH")
+    joint_weights = BODY_WEIGHTS if args.ignore_face else None
+    if args.joint_weights:
+        joint_weights = np.array([float(weight) for weight in args.joint_weights.split(',')])
+        if len(joint_weights) != len(KEY_POINTS):
+            parser.error(f"--joint-weights needs {len(KEY_POINTS)} values")
+    if (args.align_rotation or args.mirror) and not args.normalize_position:
+        parser.error("--align-rotation and --mirror need --normalize-position")
+    if args.live and args.video2.isdigit():
+        args.video2 = int(args.video2)
+
+    sds = skeleton_detection_similarity(args.video1, args.video2, args.adjust, headless=args.headless,
+                                        cache_dir=args.cache_dir, dtw_band=args.dtw_band,
+                                        stride=args.stride, target_fps=args.target_fps, adaptive=args.adaptive,
+                                        decoder=args.decoder, decode_threads=args.decode_threads,
+                                        hw_acceleration=args.hw_accel,
+                                        inference_size=args.inference_size, display_size=args.display_size,
+                                        calibration_video=args.calibration_video,
+                                        jitter_tolerance=args.jitter_tolerance,
+                                        roi=args.roi, roi_margin=args.roi_margin,
+                                        joint_weights=joint_weights, min_visibility=args.min_visibility,
+                                        normalize_position=args.normalize_position,
+                                        align_rotation=args.align_rotation, mirror=args.mirror)
+    if args.live:
+        # 參考骨架事先偵測好，即時模式中只需要偵測攝影機
+        if args.video1.endswith('.npz'):
+            reference = load_track(args.video1)
+        elif args.cache_dir is not None:
+            reference = load_landmarks(args.video1, args.adjust, cache_dir=args.cache_dir)
+        else:
+            reference = extract_landmarks(args.video1, args.adjust)
+        result = sds.run_live(reference, args.latency_target, args.loop, pace=args.pace)
+        if args.headless:
+            print(json.dumps({**result_to_dict(result), 'latency': sds.latency_report()}))
+    else:
+        result = sds.run()
+        if args.headless:
+            print(json.dumps(result_to_dict(result)))
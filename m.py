@@ -0,0 +1,256 @@
+"""
+    骨架相似度的向量化運算
+    一次 arctan2 算出所有關鍵點組的角度
+    可以輸入單一幀 (33, 3) 或整段影片 (T, 33, 3)
+"""
+
+
+import numpy as np
+
+# 定義需要比較的關鍵點組（如肩、肘、腕等）
+KEY_POINTS = np.array([
+    (11, 13, 15),   # 左肩-左肘-左腕
+    (12, 14, 16),   # 右肩-右肘-右腕
+    (23, 25, 27),   # 左臀-左膝-左踝
+    (24, 26, 28),   # 右臀-右膝-右踝
+    (11, 23, 25),   # 左肩-左腰-左膝
+    (12, 24, 26),   # 右肩-右腰-右膝
+    (13, 15, 21),   # 左肘-左腕-左大拇指
+    (14, 16, 22),   # 右肘-右腕-右大拇指
+    (19, 15, 17),   # 左手-左腕-左小拇指
+    (20, 16, 18),   # 右手-右腕-右小拇指
+    (15, 17, 19),   # 左腕-左小拇指-左手
+    (16, 18, 20),   # 右腕-右小拇指-右手
+    (25, 27, 29),   # 左膝-左角踝-左腳跟
+    (26, 28, 30),   # 右膝-右角踝-右腳跟
+    (27, 29, 31),   # 左腳踝-左腳跟-左腳大拇指
+    (28, 30, 32),   # 右腳踝-右腳跟-右腳大拇指
+    (27, 31, 29),   # 左腳踝-左腳大拇指-左腳跟
+    (28, 32, 30),   # 右腳踝-右腳大拇指-右腳跟
+    (7,  3,  2 ),   # 左耳-左外眼角-左眼
+    (8,  6,  5 ),   # 右耳-右外眼角-右眼
+    (2,  1,  0 ),   # 左眼-左內眼角-鼻子
+    (5,  4,  0 ),   # 右眼-右內眼角-鼻子
+    (1,  0,  4 )    # 左內眼角-鼻子-右內眼角
+], dtype=np.intp)
+
+# 每個關鍵點組的名稱，順序與 KEY_POINTS 相同 (報告用)
+KEY_POINT_NAMES = (
+    'left shoulder-elbow-wrist',
+    'right shoulder-elbow-wrist',
+    'left hip-knee-ankle',
+    'right hip-knee-ankle',
+    'left shoulder-hip-knee',
+    'right shoulder-hip-knee',
+    'left elbow-wrist-thumb',
+    'right elbow-wrist-thumb',
+    'left index-wrist-pinky',
+    'right index-wrist-pinky',
+    'left wrist-pinky-index',
+    'right wrist-pinky-index',
+    'left knee-ankle-heel',
+    'right knee-ankle-heel',
+    'left ankle-heel-foot index',
+    'right ankle-heel-foot index',
+    'left ankle-foot index-heel',
+    'right ankle-foot index-heel',
+    'left ear-outer eye-eye',
+    'right ear-outer eye-eye',
+    'left eye-inner eye-nose',
+    'right eye-inner eye-nose',
+    'left inner eye-nose-right inner eye',
+)
+
+# 只看身體的權重：最後 5 組是臉 (耳朵、眼睛、鼻子)，權重為 0
+BODY_WEIGHTS = np.array([1.0] * 18 + [0.0] * 5)
+
+
+# 將 mediapipe 的 landmark 轉成 (33, 4) 的陣列，欄位為 x, y, z, visibility
+# 已經是陣列的話直接回傳，有給 out 的話直接寫進 out
+def landmarks_to_array(landmarks, dtype=np.float64, out=None):
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    if out is not None:
+        out[:] = [(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks]
+        return out
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], dtype=dtype)
+
+
+# landmarks_to_array 的反向：把 (33, 3 以上) 陣列的 x, y, z 寫回 mediapipe 的 landmark (繪圖用)
+def array_to_landmarks(points, landmarks):
+    for lm, (x, y, z) in zip(landmarks, points[:, :3].tolist()):
+        lm.x = x
+        lm.y = y
+        lm.z = z
+    return landmarks
+
+
+# 計算所有關鍵點組的角度
+# points: (..., 33, 2 以上)，只取 x, y
+# 回傳: (..., len(key_points))，單位為度，範圍 0~180
+def calculate_angles(points, key_points=KEY_POINTS):
+    points = np.asarray(points)
+
+    # 一次取出所有三點組 (..., K, 3, 2)
+    triplets = points[..., key_points, :2]
+    # 由中間點指向頭尾兩點的向量 (..., K, 2, 2)
+    vectors = triplets[..., ::2, :] - triplets[..., 1:2, :]
+
+    # 兩個向量一起丟進 arctan2，只呼叫一次
+    radians = np.arctan2(vectors[..., 1], vectors[..., 0])
+    # 而求出兩個弧度後再作相減，再乘以pi，即可得到三點連線之角度。
+    angles = np.abs((radians[..., 1] - radians[..., 0]) * 180.0 / np.pi)
+
+    return np.where(angles > 180.0, 360 - angles, angles)
+
+
+# 兩組角度向量的餘弦相似度（百分比），沿最後一個維度計算
+# weights: (..., K) 每個關鍵點組的權重，None 表示全部相同
+def angle_similarity(angles1, angles2, weights=None):
+    if weights is None:
+        cosine_similarity = np.sum(angles1 * angles2, axis=-1) / (
+            np.linalg.norm(angles1, axis=-1) * np.linalg.norm(angles2, axis=-1))
+        return cosine_similarity * 100
+    # 加權的內積與長度，權重全部為 0 時為 nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine_similarity = np.sum(weights * angles1 * angles2, axis=-1) / np.sqrt(
+            np.sum(weights * angles1 ** 2, axis=-1) * np.sum(weights * angles2 ** 2, axis=-1))
+    return cosine_similarity * 100
+
+
+# 關鍵點組中每個點 XYZ 的平均歐氏距離 (只傳入 x, y 時為平面上的距離)
+# weights: (..., K) 每個關鍵點組的權重，組內的三個點都用這個權重，權重全部為 0 時為 nan
+def mean_distance(points1, points2, key_points=KEY_POINTS, weights=None):
+    idx = key_points.ravel()
+    distances = np.linalg.norm(points1[..., idx, :3] - points2[..., idx, :3], axis=-1)
+    if weights is None:
+        return np.mean(distances, axis=-1)
+    point_weights = np.repeat(weights, key_points.shape[1], axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sum(point_weights * distances, axis=-1) / np.sum(point_weights, axis=-1)
+
+
+# XYZ 位置相似度（百分比）：1 減去平均歐氏距離 (座標為 0~1 的畫面比例)
+def position_similarity(points1, points2, key_points=KEY_POINTS, weights=None):
+    return (1 - mean_distance(points1, points2, key_points, weights)) * 100
+
+
+# 左右對調時每個點對應的點 (鼻子不變，左眼 1~3 與右眼 4~6、左右耳、嘴角、肩膀 ... 對調)
+MIRROR_INDEX = np.array([0, 4, 5, 6, 1, 2, 3, 8, 7, 10, 9] +
+                        [i + 1 if i % 2 else i - 1 for i in range(11, 33)], dtype=np.intp)
+
+
+# 位置的正規化 (Procrustes)：以兩邊臀部的中點為原點，除以軀幹長度 (肩膀中點到臀部中點，同 b.py 的 get_body_ratio 以軀幹為單位)
+# 站在畫面不同位置、離鏡頭遠近不同也可以比較位置
+# mediapipe 的 x 除以畫面寬度、y 除以畫面高度，先把 x 乘上 aspect (寬 / 高)，x、y 才是相同的單位 (畫面高度)
+# 否則不是正方形的畫面中軀幹長度與旋轉角度都會算錯
+# points: (..., 33, 3 以上)，回傳新的陣列，visibility 不變，z 與 x 使用相同的比例
+def normalize_pose(points, aspect=1.0):
+    points = np.array(points, dtype=np.float64)
+    points[..., [0, 2]] *= aspect
+    hips = (points[..., 23:24, :3] + points[..., 24:25, :3]) / 2
+    shoulders = (points[..., 11:12, :3] + points[..., 12:13, :3]) / 2
+    torso = np.linalg.norm(shoulders[..., :2] - hips[..., :2], axis=-1, keepdims=True)
+    points[..., :3] = (points[..., :3] - hips) / np.maximum(torso, 1e-6)
+    return points
+
+
+# 左右鏡像：x 取負號並把左右的點對調 (之後 normalize_pose 會移回以臀部中點為中心)
+# 角度不受 x 的正負影響，鏡像後的角度就是左右兩邊的組對調
+def mirror_pose(points):
+    mirrored = points[..., MIRROR_INDEX, :].copy()
+    mirrored[..., 0] *= -1
+    return mirrored
+
+
+# 在畫面的平面 (x, y) 上旋轉 points2，讓它與 points1 的距離平方和最小 (2D 的 Kabsch)
+# 兩邊都要先 normalize_pose，只用關鍵點組中的點與 weights (..., K) 決定角度
+def align_rotation(points1, points2, key_points=KEY_POINTS, weights=None):
+    idx = key_points.ravel()
+    x1, y1 = points1[..., idx, 0], points1[..., idx, 1]
+    x2, y2 = points2[..., idx, 0], points2[..., idx, 1]
+    w = 1.0 if weights is None else np.repeat(weights, key_points.shape[1], axis=-1)
+    theta = np.arctan2(np.sum(w * (x2 * y1 - y2 * x1), axis=-1), np.sum(w * (x2 * x1 + y2 * y1), axis=-1))
+    cos, sin = np.cos(theta)[..., None], np.sin(theta)[..., None]
+
+    rotated = points2.copy()
+    rotated[..., 0] = cos * points2[..., 0] - sin * points2[..., 1]
+    rotated[..., 1] = sin * points2[..., 0] + cos * points2[..., 1]
+    return rotated
+
+
+# 正規化之後的位置相似度（百分比）：100 * exp(-d)，d 為 x, y 的平均距離，以軀幹長度為單位
+# mediapipe 的 z (相對深度) 雜訊很大，除以軀幹長度後比 x 大好幾倍，不列入距離
+# 軀幹長度不是畫面的比例，1 - d 沒有下限 (隨便兩個姿勢大約 -400)，改用 exp 對應到 0~100
+# d = 0.1 (軀幹的一成) 約 90 分，d = 0.5 約 61 分，d = 1 約 37 分
+# rotation: 先把 points2 轉到與 points1 最接近的角度
+# aspects: 兩個影片的寬 / 高 (見 normalize_pose)
+def normalized_position_similarity(points1, points2, key_points=KEY_POINTS, weights=None,
+                                   rotation=False, min_visibility=None, aspects=(1.0, 1.0)):
+    points1 = normalize_pose(points1, aspects[0])
+    points2 = normalize_pose(points2, aspects[1])
+    w = None
+    if weights is not None or min_visibility is not None:
+        w = joint_weights(points1, points2, key_points, weights, min_visibility)
+    if rotation:
+        points2 = align_rotation(points1, points2, key_points, w)
+    return np.exp(-mean_distance(points1[..., :2], points2[..., :2], key_points, w)) * 100
+
+
+# 每一幀每個關鍵點組的權重 (..., K)
+# weights: (K,) 固定的權重，None 表示全部為 1
+# min_visibility: 兩個骨架中這一組的三個點 visibility 都要超過這個值，否則權重為 0，None 表示不看 visibility
+def joint_weights(points1, points2, key_points=KEY_POINTS, weights=None, min_visibility=None):
+    shape = np.broadcast_shapes(np.shape(points1)[:-2], np.shape(points2)[:-2]) + (len(key_points),)
+    base = np.ones(len(key_points)) if weights is None else np.asarray(weights, dtype=np.float64)
+    if min_visibility is None:
+        return np.broadcast_to(base, shape)
+    visible1 = np.min(points1[..., key_points, 3], axis=-1) > min_visibility
+    visible2 = np.min(points2[..., key_points, 3], axis=-1) > min_visibility
+    return base * (visible1 & visible2)
+
+
+# 加權並排除看不清楚的點之後的角度、位置與平均相似度，可以一次計算多幀 (..., 33, 4)
+# 沒有任何一組可以比較時為 nan
+# normalize: 位置先正規化 (見 normalized_position_similarity)，rotation、mirror、aspects 只有在 normalize 時有效
+# mirror: 也比較 points2 的左右鏡像，每一幀取平均比較高的那一個，角度與位置都用同一個 (鏡像或不鏡像)
+def weighted_similarity(points1, points2, key_points=KEY_POINTS, weights=None, min_visibility=None,
+                        normalize=False, rotation=False, mirror=False, aspects=(1.0, 1.0)):
+    angles1, angles2 = calculate_angles(np.stack(np.broadcast_arrays(points1, points2)), key_points)
+    w = None
+    if weights is not None or min_visibility is not None:
+        w = joint_weights(points1, points2, key_points, weights, min_visibility)
+    angle = angle_similarity(angles1, angles2, w)
+    if not normalize:
+        position = position_similarity(points1, points2, key_points, w)
+        return angle, position, (angle + position) / 2
+
+    position = normalized_position_similarity(points1, points2, key_points, weights, rotation, min_visibility,
+                                              aspects)
+    if mirror:
+        mirrored = weighted_similarity(points1, mirror_pose(points2), key_points, weights, min_visibility,
+                                       True, rotation, False, aspects)
+        # nan 的比較為 False，不鏡像的那一個是 nan 時才會用鏡像的 nan 以外的值
+        use = (mirrored[0] + mirrored[1] > angle + position) | np.isnan(angle + position)
+        angle = np.where(use, mirrored[0], angle)[()]
+        position = np.where(use, mirrored[1], position)[()]
+    return angle, position, (angle + position) / 2
+
+
+# 比較兩段影片的骨架座標 (T, 33, 4)，逐幀配對
+# 只比較兩邊都有偵測到骨架的幀，回傳每一幀的角度、位置與平均相似度
+# weights、min_visibility 見 joint_weights，排除之後沒有任何一組可以比較的幀不列入
+# normalize、rotation、mirror、aspects 見 weighted_similarity
+def track_similarity(landmarks1, mask1, landmarks2, mask2, key_points=KEY_POINTS, weights=None, min_visibility=None,
+                     normalize=False, rotation=False, mirror=False, aspects=(1.0, 1.0)):
+    frames = min(len(landmarks1), len(landmarks2))
+    valid = mask1[:frames] & mask2[:frames]
+    points1 = landmarks1[:frames][valid]
+    points2 = landmarks2[:frames][valid]
+
+    angle, position, average = weighted_similarity(points1, points2, key_points, weights, min_visibility,
+                                                   normalize, rotation, mirror, aspects)
+    if min_visibility is not None or weights is not None:
+        keep = ~np.isnan(average)
+        return angle[keep], position[keep], average[keep]
+    return angle, position, average
@@ -0,0 +1,247 @@
+"""
+    效能測試
+    用法: python n.py <名稱> [參數...]
+    tracker : 兩個影片共用一個 Pose 與各自一個 Pose 的 fps 比較
+    sampling : 跳幀與自適應取樣相對於每幀偵測的速度與誤差
+    startup : 啟動時間，包含 import 時間與從啟動到第一幀偵測完成的時間
+    decode : 不同解碼設定 (執行緒數量、硬體加速、ffmpeg 解碼時縮小) 讀取並縮小整個影片的速度
+    stages : l.py 每個階段 (解碼、縮小、轉換 RGB、姿勢偵測...) 平均每一幀花費的時間
+"""
+
+
+import statistics
+import subprocess
+import sys
+import time
+import cv2
+import mediapipe as mp
+from w import open_video, ffmpeg_available
+
+mp_pose = mp.solutions.pose                     # mediapipe 姿勢偵測方法
+
+
+# 先把兩個影片的幀讀好並轉成 RGB，避免解碼時間影響測試結果
+def load_frames(video1, video2, adjust=3, max_frames=120):
+    cap1 = cv2.VideoCapture(video1)
+    cap2 = cv2.VideoCapture(video2)
+
+    frames = []
+    while len(frames) < max_frames:
+        ret1, frame1 = cap1.read()
+        ret2, frame2 = cap2.read()
+        if not ret1 or not ret2:
+            break
+
+        h1, w1 = frame1.shape[:2]
+        h2, w2 = frame2.shape[:2]
+        after1 = cv2.resize(frame1, (w1 // adjust, h1 // adjust))
+        after2 = cv2.resize(frame2, (w2 // adjust, h2 // adjust))
+        frames.append((cv2.cvtColor(after1, cv2.COLOR_BGR2RGB),
+                       cv2.cvtColor(after2, cv2.COLOR_BGR2RGB)))
+
+    cap1.release()
+    cap2.release()
+    return frames
+
+
+# 兩個影片輪流丟進同一個 Pose
+def bench_shared(frames):
+    with mp_pose.Pose(
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5) as pose:
+
+        detected = 0
+        start = time.perf_counter()
+        for frame1, frame2 in frames:
+            detected += pose.process(frame1).pose_landmarks is not None
+            detected += pose.process(frame2).pose_landmarks is not None
+        return time.perf_counter() - start, detected
+
+
+# 每個影片各自一個 Pose
+def bench_separate(frames):
+    with mp_pose.Pose(
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5) as pose1, \
+        mp_pose.Pose(
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5) as pose2:
+
+        detected = 0
+        start = time.perf_counter()
+        for frame1, frame2 in frames:
+            detected += pose1.process(frame1).pose_landmarks is not None
+            detected += pose2.process(frame2).pose_landmarks is not None
+        return time.perf_counter() - start, detected
+
+
+def run_tracker_benchmark(video1='B3.mp4', video2='B4.mp4'):
+    frames = load_frames(video1, video2)
+
+    shared, shared_detected = bench_shared(frames)
+    separate, separate_detected = bench_separate(frames)
+
+    print(f"frame pairs: {len(frames)}")
+    print(f"shared Pose:   {len(frames) / shared:.2f} fps, detected {shared_detected}/{2 * len(frames)}")
+    print(f"separate Pose: {len(frames) / separate:.2f} fps, detected {separate_detected}/{2 * len(frames)}")
+    print(f"speedup: {shared / separate:.2f}x")
+
+
+# 比較不同取樣方式的速度與相似度誤差，以每幀偵測的結果為準
+def run_sampling_benchmark(*videos):
+    from l import skeleton_detection_similarity
+
+    videos = videos or ('B3.mp4', 'B4.mp4', 'B7.mp4')
+    modes = [
+        ('full', {}),
+        ('stride 2', {'stride': 2}),
+        ('stride 4', {'stride': 4}),
+        ('adaptive', {'adaptive': True}),
+    ]
+
+    # 先跑一次讓模型載入，避免第一個測試多算載入時間
+    skeleton_detection_similarity(videos[0], videos[1], headless=True, stride=8).run()
+
+    for i in range(len(videos)):
+        for j in range(i + 1, len(videos)):
+            print(f"{videos[i]} vs {videos[j]}")
+            baseline = None
+            for name, options in modes:
+                start = time.perf_counter()
+                result = skeleton_detection_similarity(videos[i], videos[j], headless=True, **options).run()
+                elapsed = time.perf_counter() - start
+
+                if baseline is None:
+                    baseline = (elapsed, result.average_similarity)
+                print(f"  {name:<10} {elapsed:6.2f}s  speedup {baseline[0] / elapsed:4.2f}x  "
+                      f"frames {result.frames:4d}  similarity {result.average_similarity:6.2f}%  "
+                      f"error {abs(result.average_similarity - baseline[1]):5.2f}")
+
+
+# 從啟動到第一幀偵測完成：載入程式、打開影片、建立 Pose、偵測第一幀
+FIRST_FRAME = """
+import cv2
+from l import skeleton_detection_similarity
+from v import borrow
+sds = skeleton_detection_similarity({video1!r}, {video2!r}, headless=True)
+ret, frame = sds.cap1.read()
+frame = cv2.cvtColor(cv2.resize(frame, (sds.resized_width1, sds.resized_height1)), cv2.COLOR_BGR2RGB)
+with borrow() as pose:
+    pose.process(frame)
+"""
+
+
+# 每次都在新的 process 中執行，回傳花費秒數的中位數
+def time_process(args, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def run_startup_benchmark(video1='B3.mp4', video2='B4.mp4', repeat=5):
+    repeat = int(repeat)
+    cases = [
+        ('python', ['-c', 'pass']),
+        ('import mediapipe', ['-c', 'import mediapipe']),
+        ('import l', ['-c', 'import l']),
+        ('l.py --help', ['l.py', '--help']),
+        ('k.py --help', ['k.py', '--help']),
+        ('first frame', ['-c', FIRST_FRAME.format(video1=video1, video2=video2)]),
+    ]
+
+    print(f"median of {repeat} runs")
+    for name, args in cases:
+        print(f"  {name:<18} {time_process(args, repeat):6.3f}s")
+
+
+# 讀完整個影片並縮小成 1/adjust，回傳花費的秒數與幀數
+def bench_decode(video, adjust, decoder, threads, hw_acceleration):
+    start = time.perf_counter()
+    cap = open_video(video, decoder, adjust, threads, hw_acceleration)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) // adjust
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) // adjust
+
+    frames = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        # ffmpeg 讀到的已經是縮小後的大小
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height))
+        frames += 1
+    cap.release()
+    return time.perf_counter() - start, frames
+
+
+def run_decode_benchmark(*videos, adjust=3):
+    videos = videos or ('B3.mp4', 'B4.mp4', 'B7.mp4')
+    modes = [
+        ('opencv', {'decoder': 'opencv', 'threads': 0, 'hw_acceleration': False}),
+        ('opencv 1 thread', {'decoder': 'opencv', 'threads': 1, 'hw_acceleration': False}),
+        ('opencv 4 threads', {'decoder': 'opencv', 'threads': 4, 'hw_acceleration': False}),
+        ('opencv hw', {'decoder': 'opencv', 'threads': 0, 'hw_acceleration': True}),
+    ]
+    if ffmpeg_available():
+        modes += [
+            ('ffmpeg', {'decoder': 'ffmpeg', 'threads': 0, 'hw_acceleration': False}),
+            ('ffmpeg hw', {'decoder': 'ffmpeg', 'threads': 0, 'hw_acceleration': True}),
+        ]
+    else:
+        print("ffmpeg not found, skipping the ffmpeg decoder")
+
+    for video in videos:
+        # 先讀一次讓檔案進入快取
+        bench_decode(video, adjust, 'opencv', 0, False)
+
+        print(video)
+        baseline = None
+        for name, options in modes:
+            elapsed, frames = bench_decode(video, adjust, **options)
+            if baseline is None:
+                baseline = elapsed
+            print(f"  {name:<18} {elapsed:6.2f}s  {frames / elapsed:7.1f} fps  "
+                  f"speedup {baseline / elapsed:4.2f}x  frames {frames}")
+
+
+# 比較 opencv 解碼 (BGR，需要縮小並轉換成 RGB) 與 ffmpeg 解碼 (縮小後的 BGR，只需要轉換) 每個階段的時間
+def run_stages_benchmark(video1='B3.mp4', video2='B4.mp4', *adjusts):
+    from l import skeleton_detection_similarity, TIMING_STAGES
+
+    adjusts = [int(adjust) for adjust in adjusts] or [3, 1]
+    decoders = [('opencv', {'decoder': 'opencv'})]
+    if ffmpeg_available():
+        decoders.append(('ffmpeg', {'decoder': 'ffmpeg'}))
+    else:
+        print("ffmpeg not found, skipping the ffmpeg decoder")
+
+    # 先跑一次讓模型載入
+    skeleton_detection_similarity(video1, video2, headless=True, stride=8).run()
+
+    print(f"{'adjust':>6} {'decoder':<10}" + "".join(f"{stage:>11}" for stage in TIMING_STAGES) + "  (ms per frame)")
+    for adjust in adjusts:
+        for name, options in decoders:
+            sds = skeleton_detection_similarity(video1, video2, adjust, headless=True, **options)
+            sds.run()
+            report = sds.timing_report()
+            print(f"{adjust:>6} {name:<10}" + "".join(f"{report[stage]:>11.2f}" for stage in TIMING_STAGES))
+
+
+# 可以執行的測試
+benchmarks = {
+    'tracker': run_tracker_benchmark,
+    'sampling': run_sampling_benchmark,
+    'startup': run_startup_benchmark,
+    'decode': run_decode_benchmark,
+    'stages': run_stages_benchmark,
+}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("usage: python n.py {" + ",".join(benchmarks) + "} [args...]")
+        exit()
+    benchmarks[sys.argv[1]](*sys.argv[2:])
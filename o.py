@@ -0,0 +1,195 @@
+"""
+    以 l.py 為基礎，將流程拆成平行的幾個階段
+    每個影片各自有一個解碼執行緒與一個姿勢偵測執行緒
+    主執行緒依照幀的編號重新配對後計算相似度並合併顯示
+    各階段之間用有上限的 queue 連接，避免記憶體無限制增長
+"""
+
+
+import queue
+import threading
+import cv2
+import numpy as np
+from l import skeleton_detection_similarity
+from r import timestamp_reader
+from v import borrow
+
+
+class parallel_skeleton_detection_similarity(skeleton_detection_similarity):
+    def __init__(self, video1, video2, adjust=3, headless=False, queue_size=8):
+        super().__init__(video1, video2, adjust, headless)
+        self.queue_size = queue_size
+        self.stop_event = threading.Event()
+
+    # 放進 queue，若已經要求停止就放棄，避免卡在已滿的 queue
+    def put(self, q, item):
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # 從 queue 取出，若已經要求停止就回傳 None
+    def get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    # 解碼階段：依照 fps 的時間軸讀取影片並調整長寬，結束時放入 None
+    def decode_worker(self, reader, fps, size, out_queue):
+        index = 0
+        while not self.stop_event.is_set():
+            ret, frame = reader.read_at(index / fps)
+            if not ret:
+                break
+            if not self.put(out_queue, (index, cv2.resize(frame, size))):
+                return
+            index += 1
+        self.put(out_queue, None)
+
+    # 姿勢偵測階段：每個影片各自使用一個 Pose，並在畫面上標記骨架
+    def pose_worker(self, in_queue, out_queue):
+        with borrow(
+            min_detection_confidence=self.min_detection_confidence,
+            min_tracking_confidence=self.min_tracking_confidence) as pose:
+
+            while True:
+                item = self.get(in_queue)
+                if item is None:
+                    break
+                index, after = item
+
+                resized_frame = cv2.cvtColor(after, cv2.COLOR_BGR2RGB)   # 將 BGR 轉換成 RGB
+                results = pose.process(resized_frame)                    # 取得姿勢偵測結果
+                # 根據姿勢偵測結果，標記身體節點和骨架
+                if not self.headless:
+                    self.mp_drawing.draw_landmarks(
+                        after,
+                        results.pose_landmarks,
+                        self.mp_pose.POSE_CONNECTIONS,
+                        landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
+
+                if not self.put(out_queue, (index, after, results.pose_landmarks)):
+                    return
+        self.put(out_queue, None)
+
+    def run(self):
+        # 確認是否成功打開
+        if not self.cap1.isOpened():
+            if self.headless:
+                raise IOError("Cannot open camera1")
+            print("Cannot open camera1")
+            exit()
+        if not self.cap2.isOpened():
+            if self.headless:
+                raise IOError("Cannot open camera2")
+            print("Cannot open camera2")
+            exit()
+
+        # 上一次 run() 結束時設定了 stop_event，同一個物件再執行一次時要先清除
+        self.stop_event.clear()
+
+        decoded1 = queue.Queue(self.queue_size)
+        decoded2 = queue.Queue(self.queue_size)
+        detected1 = queue.Queue(self.queue_size)
+        detected2 = queue.Queue(self.queue_size)
+
+        # 兩個影片的幀率不同時，以較低的為準
+        reader1 = timestamp_reader(self.cap1)
+        reader2 = timestamp_reader(self.cap2)
+        fps = min(reader1.fps, reader2.fps)
+
+        workers = [
+            threading.Thread(target=self.decode_worker, args=(reader1, fps, (self.resized_width1, self.resized_height1), decoded1)),
+            threading.Thread(target=self.decode_worker, args=(reader2, fps, (self.resized_width2, self.resized_height2), decoded2)),
+            threading.Thread(target=self.pose_worker, args=(decoded1, detected1)),
+            threading.Thread(target=self.pose_worker, args=(decoded2, detected2)),
+        ]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+
+        # 創建分隔線
+        separator = np.zeros((self.resized_height1, 10, 3), dtype=np.uint8)
+        separator[:] = (0, 0, 255)  # 將分隔線設置為紅色
+
+        # 依照幀的編號重新配對兩個影片的結果
+        pending1 = {}
+        pending2 = {}
+        index = 0
+        finished1 = finished2 = False
+        while True:
+            if index not in pending1 and not finished1:
+                item = self.get(detected1)
+                if item is None:
+                    finished1 = True
+                else:
+                    pending1[item[0]] = item
+                continue
+            if index not in pending2 and not finished2:
+                item = self.get(detected2)
+                if item is None:
+                    finished2 = True
+                else:
+                    pending2[item[0]] = item
+                continue
+            if index not in pending1 or index not in pending2:
+                if not self.headless:
+                    print("Cannot receive frame")
+                break
+
+            _, after1, landmarks1 = pending1.pop(index)
+            _, after2, landmarks2 = pending2.pop(index)
+            index += 1
+
+            # 如果兩個視頻都有檢測到骨架，計算相似度
+            if landmarks1 and landmarks2:
+                self.add_similarity(*self.calculate_similarity(landmarks1.landmark, landmarks2.landmark))
+
+            # headless 模式不顯示
+            if self.headless:
+                continue
+
+            # 合併兩個視頻到一個窗口中
+            combined_frame = np.hstack((after1, separator, after2))
+
+            # 顯示調整後的視頻
+            cv2.imshow('Combined Video', combined_frame)
+
+            # 按 'q' 鍵退出
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+
+        # 通知所有執行緒停止
+        self.stop_event.set()
+        for worker in workers:
+            worker.join()
+
+        # 釋放視頻對象
+        self.cap1.release()
+        self.cap2.release()
+
+        result = self.get_result()
+        if self.headless:
+            return result
+
+        print("keypoint len:", len(self.key_points))
+        print("list len:", result.frames)
+        # 印出相似度
+        print(f"Average Angle Similarity: {result.angle_similarity:.2f}%")
+        print(f"Average Position Similarity: {result.position_similarity:.2f}%")
+        print(f"Overall Average Similarity: {result.average_similarity:.2f}%")
+
+        # 關閉所有窗口
+        cv2.destroyAllWindows()
+        return result
+
+
+if __name__ == '__main__':
+    sds = parallel_skeleton_detection_similarity('B3.mp4', 'B4.mp4')
+    sds.run()
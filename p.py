@@ -0,0 +1,225 @@
+"""
+    骨架座標快取
+    對一個影片跑一次姿勢偵測，把每一幀的 landmark 存成壓縮的 .npz
+    內容為 landmarks (T, 33, 4) float32、mask、timestamps 與 fps
+    以影片內容的 hash、adjust、偵測與追蹤信心值作為 key
+    hash 記在快取資料夾的 hashes.json (路徑、大小與修改時間)，影片沒有改變時不需要重新讀整個影片
+    同一個參考影片比對多個影片時，不需要每次都重新偵測
+    用法: python p.py extract B3.mp4 -o B3.npz
+          python p.py compare B3.npz B4.npz
+"""
+
+
+import argparse
+import hashlib
+import json
+import os
+import zipfile
+from collections import namedtuple
+import cv2
+import numpy as np
+from m import landmarks_to_array, track_similarity
+from v import borrow
+
+# 預設的快取資料夾
+CACHE_DIR = 'landmark_cache'
+
+# .npz 的格式版本，改變存放的內容時要加一
+# 早期的快取只有 landmarks 與 mask，版本不同的快取檔名不同，不會讀到舊的格式
+TRACK_FORMAT = 2
+
+
+# 記錄每個影片 hash 的檔案 (在快取資料夾中)
+HASH_INDEX = 'hashes.json'
+
+
+# 計算影片內容的 hash，檔名或路徑不同但內容相同的影片會共用快取
+def video_hash(video, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(video, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+# 與 video_hash 相同，但先查 cache_dir 中的 hashes.json
+# 路徑、大小與修改時間 (ns) 都相同時直接用記下的 hash，影片改變時才重新讀整個影片並更新紀錄
+def cached_video_hash(video, cache_dir=CACHE_DIR):
+    stat = os.stat(video)
+    key = os.path.abspath(video)
+    index_path = os.path.join(cache_dir, HASH_INDEX)
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+
+    entry = index.get(key)
+    if entry and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return entry['sha1']
+
+    digest = video_hash(video)
+    index[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}
+    # 與 save_track 相同，先寫到暫存檔再改名，多個程式同時更新時只會少記一筆，不會寫壞
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+    return digest
+
+
+# 快取檔案路徑
+def cache_path(video, adjust=3, min_detection_confidence=0.5, min_tracking_confidence=0.5, cache_dir=CACHE_DIR):
+    name = (f"{cached_video_hash(video, cache_dir)}_a{adjust}_d{min_detection_confidence}"
+            f"_t{min_tracking_confidence}_v{TRACK_FORMAT}.npz")
+    return os.path.join(cache_dir, name)
+
+
+# 一個影片的骨架座標
+landmark_track = namedtuple('landmark_track', [
+    'landmarks',    # (T, 33, 4) float32，欄位為 x, y, z, visibility
+    'mask',         # (T,) bool，該幀是否有偵測到骨架
+    'timestamps',   # (T,) float64，每一幀的時間 (秒)
+    'fps'           # 影片的幀率
+])
+
+
+# 對整個影片做姿勢偵測，回傳 landmark_track
+def extract_landmarks(video, adjust=3, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {video}")
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    resized_width = width // adjust
+    resized_height = height // adjust
+
+    # 依照影片的幀數先配置好陣列，landmark 直接寫進去，幀數不準時再加大
+    capacity = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 1)
+    landmarks = np.zeros((capacity, 33, 4), dtype=np.float32)
+    mask = np.zeros(capacity, dtype=bool)
+    timestamps = np.zeros(capacity, dtype=np.float64)
+
+    frames = 0
+    with borrow(
+        min_detection_confidence=min_detection_confidence,
+        min_tracking_confidence=min_tracking_confidence) as pose:
+
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            if frames == capacity:
+                capacity *= 2
+                landmarks = np.resize(landmarks, (capacity, 33, 4))
+                mask = np.resize(mask, capacity)
+                timestamps = np.resize(timestamps, capacity)
+
+            timestamps[frames] = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            after = cv2.resize(frame, (resized_width, resized_height))
+            results = pose.process(cv2.cvtColor(after, cv2.COLOR_BGR2RGB))
+
+            if results.pose_landmarks:
+                landmarks_to_array(results.pose_landmarks.landmark, out=landmarks[frames])
+                mask[frames] = True
+            else:
+                landmarks[frames] = 0
+                mask[frames] = False
+            frames += 1
+
+    cap.release()
+    return landmark_track(landmarks[:frames], mask[:frames], timestamps[:frames], fps)
+
+
+# 把骨架座標重新取樣到 fps 的時間軸上，每個時間點取最接近的幀
+# 用來比較兩個幀率不同的影片
+def resample_track(track, fps):
+    if fps == track.fps or len(track.mask) == 0:
+        return track
+    count = int(np.floor((len(track.mask) - 1) / track.fps * fps)) + 1
+    index = np.round(np.arange(count) / fps * track.fps).astype(np.intp)
+    index = np.minimum(index, len(track.mask) - 1)
+    return landmark_track(track.landmarks[index], track.mask[index], np.arange(count) / fps, fps)
+
+
+# 存成壓縮的 .npz，先寫到暫存檔再改名，避免多個程式同時寫入時讀到寫一半的檔案
+def save_track(path, track):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, landmarks=track.landmarks, mask=track.mask,
+                            timestamps=track.timestamps, fps=track.fps, version=TRACK_FORMAT)
+    os.replace(tmp_path, path)
+
+
+# 讀取 save_track 存的檔案，格式不符時丟出 ValueError
+# 沒有 version 但欄位齊全的檔案 (加上版本之前存的) 也可以讀
+def load_track(path):
+    with np.load(path) as data:
+        version = int(data['version']) if 'version' in data.files else TRACK_FORMAT
+        missing = {'landmarks', 'mask', 'timestamps', 'fps'} - set(data.files)
+        if version != TRACK_FORMAT or missing:
+            raise ValueError(f"{path}: unsupported landmark track format (version {version}, missing {sorted(missing)})")
+        return landmark_track(data['landmarks'], data['mask'], data['timestamps'], float(data['fps']))
+
+
+# 讀取快取，沒有的話就偵測一次並存起來
+def load_landmarks(video, adjust=3, min_detection_confidence=0.5, min_tracking_confidence=0.5, cache_dir=CACHE_DIR):
+    path = cache_path(video, adjust, min_detection_confidence, min_tracking_confidence, cache_dir)
+    if os.path.exists(path):
+        try:
+            return load_track(path)
+        except (ValueError, OSError, zipfile.BadZipFile):
+            # 格式不符或檔案損壞時重新偵測並覆蓋
+            pass
+
+    track = extract_landmarks(video, adjust, min_detection_confidence, min_tracking_confidence)
+    save_track(path, track)
+    return track
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="skeleton landmark extraction")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    # 對影片做一次姿勢偵測並輸出 .npz
+    extract_parser = subparsers.add_parser('extract', help="偵測影片的骨架並存成 .npz")
+    extract_parser.add_argument('video')
+    extract_parser.add_argument('-o', '--output', help="輸出檔名，預設為影片檔名加上 .npz")
+    extract_parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    extract_parser.add_argument('--min-detection-confidence', type=float, default=0.5)
+    extract_parser.add_argument('--min-tracking-confidence', type=float, default=0.5)
+
+    # 比較兩個 .npz，不需要再做姿勢偵測
+    compare_parser = subparsers.add_parser('compare', help="比較兩個 .npz 的骨架相似度")
+    compare_parser.add_argument('track1')
+    compare_parser.add_argument('track2')
+
+    args = parser.parse_args()
+
+    if args.command == 'extract':
+        track = extract_landmarks(args.video, args.adjust, args.min_detection_confidence, args.min_tracking_confidence)
+        output = args.output or os.path.splitext(args.video)[0] + '.npz'
+        save_track(output, track)
+        print(f"{output}: {len(track.mask)} frames, {int(track.mask.sum())} detected")
+    else:
+        track1 = load_track(args.track1)
+        track2 = load_track(args.track2)
+        # 幀率不同時，與 l.py、ab.py 相同，重新取樣到較低的幀率上再配對
+        fps = min(track1.fps, track2.fps)
+        track1 = resample_track(track1, fps)
+        track2 = resample_track(track2, fps)
+        angle, position, average = track_similarity(track1.landmarks, track1.mask, track2.landmarks, track2.mask)
+        # 沒有可以比較的幀時輸出 null (JSON 沒有 NaN)
+        print(json.dumps({
+            'frames': len(average),
+            'angle_similarity': float(np.mean(angle)) if len(average) else None,
+            'position_similarity': float(np.mean(position)) if len(average) else None,
+            'average_similarity': float(np.mean(average)) if len(average) else None,
+        }))
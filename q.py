@@ -0,0 +1,181 @@
+"""
+    動態時間校正 (DTW)
+    兩個影片的節奏不同或有時間差時，逐幀配對會讓相似度變得很差
+    先用每一幀的角度向量找出最佳的對應路徑，再沿著路徑計算相似度
+    只計算對角線附近 band 幀以內的格子 (Sakoe-Chiba band)，記憶體為 O(T * band)
+    用法: python q.py B3.npz B4.npz --band 30
+"""
+
+
+import argparse
+import json
+from collections import namedtuple
+import numpy as np
+from m import KEY_POINTS, BODY_WEIGHTS, calculate_angles, joint_weights, weighted_similarity
+
+# DTW 的結果
+dtw_result = namedtuple('dtw_result', [
+    'angle_similarity',     # 沿著路徑的平均角度相似度
+    'position_similarity',  # 沿著路徑的平均位置相似度
+    'average_similarity',   # 兩者的平均
+    'path'                  # (L, 2) 的對應路徑，內容為兩個影片的幀編號
+])
+
+
+# 每一列 (影片1 的一幀) 可以對應到影片2 的範圍 [lo, hi)
+# 以兩個影片長度的比例作為對角線，左右各 band 幀
+def band_window(length1, length2, band):
+    # band 太小時相鄰兩列的範圍會接不起來，至少要有斜率那麼寬
+    band = max(band, int(np.ceil(length2 / length1)))
+    center = np.round(np.arange(length1) * (length2 - 1) / max(length1 - 1, 1)).astype(np.intp)
+    lo = np.clip(center - band, 0, length2 - 1)
+    hi = np.clip(center + band + 1, 1, length2)
+    return lo, hi, 2 * band + 1
+
+
+# 計算 band 內每一格的距離 (1 - 餘弦相似度)，回傳 (T1, width)，超出範圍為 inf
+# 一次處理 block 列，避免 (T1, width, 23) 的暫存陣列太大
+def band_cost(angles1, angles2, lo, hi, width, block=256):
+    # 全部的組都被排除 (長度為 0) 時距離為 1
+    unit1 = angles1 / np.maximum(np.linalg.norm(angles1, axis=-1, keepdims=True), 1e-9)
+    unit2 = angles2 / np.maximum(np.linalg.norm(angles2, axis=-1, keepdims=True), 1e-9)
+
+    cost = np.full((len(angles1), width), np.inf)
+    offsets = np.arange(width)
+    for start in range(0, len(angles1), block):
+        rows = slice(start, start + block)
+        columns = lo[rows, None] + offsets
+        inside = columns < hi[rows, None]
+        similarity = np.einsum('id,iwd->iw', unit1[rows], unit2[np.minimum(columns, len(angles2) - 1)])
+        cost[rows] = np.where(inside, 1 - similarity, np.inf)
+    return cost
+
+
+# DTW 對齊兩組角度向量 (T1, K) 與 (T2, K)，回傳 (L, 2) 的對應路徑
+# 其中一邊沒有任何幀時回傳空的路徑 (0, 2)
+def dtw_align(angles1, angles2, band=30):
+    length1 = len(angles1)
+    length2 = len(angles2)
+    if length1 == 0 or length2 == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+    lo, hi, width = band_window(length1, length2, band)
+    cost = band_cost(angles1, angles2, lo, hi, width)
+
+    # 累積距離，第 i 列的第 w 格對應影片2 的第 lo[i] + w 幀
+    total = np.full((length1, width), np.inf)
+    previous = np.full(width + 1, np.inf)
+    for i in range(length1):
+        c = cost[i]
+        if i == 0:
+            # 起點固定在 (0, 0)
+            m = np.full(width, np.inf)
+            m[0] = c[0]
+        else:
+            # 上一列對齊到這一列的位置，shift 之後 up[w] 為 (i-1, j)，diag[w] 為 (i-1, j-1)
+            shift = lo[i] - lo[i - 1]
+            shifted = np.full(width + 1, np.inf)
+            if shift <= width:
+                shifted[:width + 1 - shift] = previous[shift:]
+            up = shifted[1:]
+            diag = shifted[:-1]
+            m = c + np.minimum(up, diag)
+
+        # 同一列往右走：D[j] = min(m[j], c[j] + D[j-1])
+        # 展開後 D[j] = S[j] + min_{k<=j}(m[k] - S[k])，S 為 c 的累加
+        finite = np.isfinite(c)
+        s = np.cumsum(np.where(finite, c, 0))
+        row = s + np.minimum.accumulate(m - s)
+        row[~finite] = np.inf
+        total[i] = row
+
+        previous[1:] = row
+        previous[0] = np.inf
+
+    # 從終點往回找路徑
+    i, j = length1 - 1, length2 - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        candidates = []
+        if i > 0 and j > 0:
+            candidates.append((lookup(total, lo, width, i - 1, j - 1), i - 1, j - 1))
+        if i > 0:
+            candidates.append((lookup(total, lo, width, i - 1, j), i - 1, j))
+        if j > 0:
+            candidates.append((lookup(total, lo, width, i, j - 1), i, j - 1))
+        _, i, j = min(candidates)
+        path.append((i, j))
+
+    return np.array(path[::-1], dtype=np.intp)
+
+
+# 從 band 形式的表格取出 (i, j) 的值，範圍外為 inf
+def lookup(table, lo, width, i, j):
+    w = j - lo[i]
+    if 0 <= w < width:
+        return table[i, w]
+    return np.inf
+
+
+# 對齊時每一幀的角度向量乘上 sqrt(權重)，餘弦相似度就會是加權的餘弦相似度
+# 看不清楚的組在那一幀的權重為 0 (只看這一邊的 visibility，兩邊都看要等配對之後才知道)
+def weighted_angles(points, key_points=KEY_POINTS, weights=None, min_visibility=None):
+    angles = calculate_angles(points, key_points)
+    if weights is None and min_visibility is None:
+        return angles
+    return angles * np.sqrt(joint_weights(points, points, key_points, weights, min_visibility))
+
+
+# 對齊兩段骨架座標 (T, 33, 4)，只使用有偵測到骨架的幀
+# 回傳的路徑為原本影片的幀編號
+# weights、min_visibility 見 m.py 的 joint_weights，對齊與相似度都會使用
+def align_tracks(landmarks1, mask1, landmarks2, mask2, band=30, key_points=KEY_POINTS, weights=None, min_visibility=None):
+    frames1 = np.flatnonzero(mask1)
+    frames2 = np.flatnonzero(mask2)
+    points1 = landmarks1[frames1]
+    points2 = landmarks2[frames2]
+
+    path = dtw_align(weighted_angles(points1, key_points, weights, min_visibility),
+                     weighted_angles(points2, key_points, weights, min_visibility), band)
+
+    # 其中一邊完全沒有偵測到骨架，沒有可以比較的幀
+    if len(path) == 0:
+        return dtw_result(float('nan'), float('nan'), float('nan'), np.zeros((0, 2), dtype=np.intp))
+
+    # 沿著路徑配對後，用跟 l.py 相同的方式計算相似度
+    # 沒有任何一組可以比較的配對 (nan) 不列入平均
+    aligned1 = points1[path[:, 0]]
+    aligned2 = points2[path[:, 1]]
+    angle, position, average = weighted_similarity(aligned1, aligned2, key_points, weights, min_visibility)
+    keep = ~np.isnan(average)
+    if not keep.any():
+        return dtw_result(float('nan'), float('nan'), float('nan'), path[:0])
+
+    return dtw_result(
+        angle_similarity=float(np.mean(angle[keep])),
+        position_similarity=float(np.mean(position[keep])),
+        average_similarity=float(np.mean(average[keep])),
+        path=np.stack((frames1[path[:, 0]], frames2[path[:, 1]]), axis=1))
+
+
+if __name__ == '__main__':
+    from p import load_track
+
+    parser = argparse.ArgumentParser(description="DTW skeleton similarity")
+    parser.add_argument('track1', help="p.py extract 輸出的 .npz")
+    parser.add_argument('track2', help="p.py extract 輸出的 .npz")
+    parser.add_argument('--band', type=int, default=30, help="對角線左右可以偏移的幀數")
+    parser.add_argument('--ignore-face', action='store_true', help="臉的 5 組 (耳朵、眼睛、鼻子) 不列入相似度")
+    parser.add_argument('--min-visibility', type=float, default=None, help="visibility 不超過這個值的點所在的組不列入相似度")
+    args = parser.parse_args()
+
+    track1 = load_track(args.track1)
+    track2 = load_track(args.track2)
+    result = align_tracks(track1.landmarks, track1.mask, track2.landmarks, track2.mask, args.band, KEY_POINTS,
+                          BODY_WEIGHTS if args.ignore_face else None, args.min_visibility)
+    # 沒有可以比較的幀時輸出 null (JSON 沒有 NaN)
+    print(json.dumps({
+        'path_length': len(result.path),
+        'angle_similarity': result.angle_similarity if len(result.path) else None,
+        'position_similarity': result.position_similarity if len(result.path) else None,
+        'average_similarity': result.average_similarity if len(result.path) else None,
+    }))
@@ -0,0 +1,107 @@
+"""
+    依照時間配對兩個影片的幀
+    兩個影片的幀率不同時 (例如 60 fps 與 30 fps)，以較低的幀率為準
+    依照每一幀的時間找出另一個影片最接近的幀
+    用不到的幀只 grab() 不 retrieve()，不會被完整解碼也不會做姿勢偵測
+    也可以每隔幾幀取樣一次，或依照動作變化的大小自動調整取樣間隔
+"""
+
+
+import cv2
+import numpy as np
+from m import calculate_angles
+
+
+# 依照時間讀取影片，只解碼需要的幀
+class timestamp_reader:
+    def __init__(self, cap):
+        self.cap = cap
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.index = 0          # 下一次 grab() 會拿到的幀編號
+        self.frame = None       # 上一次解碼的幀
+
+    # 讀取第 index 幀，跳過的幀只 grab()
+    def read_index(self, index):
+        # 要的就是上一次解碼的幀
+        if index < self.index:
+            return self.frame is not None, self.frame
+
+        while self.index < index:
+            if not self.cap.grab():
+                return False, None
+            self.index += 1
+
+        if not self.cap.grab():
+            return False, None
+        self.index += 1
+        ret, self.frame = self.cap.retrieve()
+        return ret, self.frame
+
+    # 讀取最接近 seconds 秒的幀
+    def read_at(self, seconds):
+        return self.read_index(int(round(seconds * self.fps)))
+
+
+# 以兩個影片中較低的幀率為時間軸，每次回傳同一時間的兩幀
+# fps 比影片還低時以 fps 為時間軸，step 為下一次在時間軸上前進幾格
+# step 在 read() 之間修改時，下一次 read() 就會用新的 step
+class frame_pairer:
+    def __init__(self, cap1, cap2, fps=None, step=1):
+        self.reader1 = timestamp_reader(cap1)
+        self.reader2 = timestamp_reader(cap2)
+        self.fps = min(self.reader1.fps, self.reader2.fps)
+        if fps:
+            self.fps = min(self.fps, fps)
+        self.step = step
+        self.index = 0          # 上一次 read() 的位置 (時間軸上的格數)
+        self.gap = 0            # 上一次 read() 與前一次相隔幾格，第一次為 step，也就是這一組代表的幀數
+        self.started = False
+
+    # 目前這一組的時間 (秒)
+    def timestamp(self):
+        return self.index / self.fps
+
+    # 跟 cap.read() 一樣的用法，回傳 ret, frame1, frame2
+    def read(self):
+        index = self.index + self.step if self.started else 0
+        seconds = index / self.fps
+        ret1, frame1 = self.reader1.read_at(seconds)
+        ret2, frame2 = self.reader2.read_at(seconds)
+        if not ret1 or not ret2:
+            return False, None, None
+        self.gap = index - self.index if self.started else self.step
+        self.index = index
+        self.started = True
+        return True, frame1, frame2
+
+
+# 自適應取樣：依照前後兩次取樣之間角度的變化決定下一次的間隔
+# 每一幀平均變化小於 low 度時間隔加倍 (最多 max_step)，大於 high 度時恢復為 min_step
+class adaptive_sampler:
+    def __init__(self, min_step=1, max_step=8, low=2.0, high=6.0):
+        self.min_step = min_step
+        self.max_step = max(max_step, min_step)
+        self.low = low
+        self.high = high
+        self.step = min_step
+        self.previous = None
+
+    # points: (..., 33, 2 以上) 的骨架座標，沒有偵測到骨架時為 None
+    # gap: 這一次與上一次取樣實際相隔的幀數 (frame_pairer.gap)，沒有給的話當作目前的 step
+    # 回傳下一次取樣要前進幾幀
+    def update(self, points, gap=None):
+        if points is None:
+            # 沒有骨架時每幀取樣，才能盡快重新偵測到
+            self.step = self.min_step
+            self.previous = None
+            return self.step
+
+        angles = calculate_angles(points)
+        if self.previous is not None:
+            change = np.mean(np.abs(angles - self.previous)) / (gap or self.step)
+            if change > self.high:
+                self.step = self.min_step
+            elif change < self.low:
+                self.step = min(self.step * 2, self.max_step)
+        self.previous = angles
+        return self.step
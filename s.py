@@ -0,0 +1,108 @@
+"""
+    相似度的串流統計
+    不保留每一幀的數值，記憶體固定
+    記錄平均、變異數、最小最大值、直方圖 (估計百分位數) 與最近幾幀的平均
+    執行到一半也可以隨時查詢
+"""
+
+
+from collections import deque
+import numpy as np
+
+
+class similarity_stats:
+    # window: 最近幾幀的平均要看幾幀
+    # low, high, bins: 直方圖的範圍與格數，超出範圍的值算在最旁邊的格子
+    def __init__(self, window=30, low=-100.0, high=100.0, bins=2000):
+        self.count = 0              # 幀數
+        self.weight = 0.0           # 權重總和
+        self.mean = float('nan')    # 加權平均
+        self.m2 = 0.0               # 與平均差的平方和，用來算變異數
+        self.min = float('inf')
+        self.max = float('-inf')
+
+        self.low = low
+        self.high = high
+        self.histogram = np.zeros(bins)
+
+        self.recent = deque(maxlen=window)
+        self.recent_weights = deque(maxlen=window)
+
+    # 加入一幀或一批幀的相似度，weights 為每一幀代表的幀數
+    def add(self, values, weights=1):
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if values.size == 0:
+            return
+        weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), values.shape)
+
+        # 先算這一批的平均與平方和，再跟目前的結果合併 (Chan 的平行演算法)
+        weight = weights.sum()
+        mean = np.sum(weights * values) / weight
+        m2 = np.sum(weights * (values - mean) ** 2)
+        if self.count == 0:
+            self.mean = mean
+            self.m2 = m2
+        else:
+            total = self.weight + weight
+            delta = mean - self.mean
+            self.mean += delta * weight / total
+            self.m2 += m2 + delta ** 2 * self.weight * weight / total
+        self.weight += weight
+        self.count += values.size
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        bins = len(self.histogram)
+        index = ((values - self.low) / (self.high - self.low) * bins).astype(np.intp)
+        np.add.at(self.histogram, np.clip(index, 0, bins - 1), weights)
+
+        self.recent.extend(values.tolist())
+        self.recent_weights.extend(weights.tolist())
+
+    # 加權變異數
+    def variance(self):
+        if self.weight == 0:
+            return float('nan')
+        return self.m2 / self.weight
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    # 由直方圖估計第 q 百分位數，誤差在一格以內
+    def percentile(self, q):
+        if self.weight == 0:
+            return float('nan')
+        cumulative = np.cumsum(self.histogram)
+        target = q / 100 * self.weight
+        i = min(int(np.searchsorted(cumulative, target)), len(self.histogram) - 1)
+
+        # 在格子內線性內插
+        before = cumulative[i - 1] if i > 0 else 0.0
+        fraction = (target - before) / self.histogram[i] if self.histogram[i] > 0 else 0.5
+        width = (self.high - self.low) / len(self.histogram)
+        value = self.low + (i + fraction) * width
+        return float(np.clip(value, self.min, self.max))
+
+    # 最近 window 幀的加權平均，與整體的平均使用相同的權重
+    def window_mean(self):
+        if not self.recent:
+            return float('nan')
+        weights = np.asarray(self.recent_weights)
+        if weights.sum() == 0:
+            return float('nan')
+        return float(np.average(self.recent, weights=weights))
+
+    # 整理成 dict
+    def summary(self):
+        return {
+            'frames': self.count,
+            'mean': float(self.mean),
+            'std': float(self.std()),
+            'min': float(self.min) if self.count else float('nan'),
+            'max': float(self.max) if self.count else float('nan'),
+            'p10': self.percentile(10),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'window_mean': self.window_mean(),
+        }
@@ -0,0 +1,100 @@
+"""
+    一個參考影片比對多個影片
+    參考影片只做一次姿勢偵測，其他影片用多個 process 同時偵測
+    最後把所有影片疊成 (N, T, 33, 4) 一次算完相似度並排名
+    用法: python t.py B3.mp4 B4.mp4 B7.mp4 --processes 4
+"""
+
+
+import argparse
+from collections import namedtuple
+from multiprocessing import Pool
+import numpy as np
+from m import KEY_POINTS, BODY_WEIGHTS, weighted_similarity
+from p import extract_landmarks, load_landmarks, resample_track
+
+# 每個影片的比對結果
+candidate_result = namedtuple('candidate_result', [
+    'video',                # 影片路徑
+    'frames',               # 兩邊都有偵測到骨架的幀數
+    'angle_similarity',     # 平均角度相似度
+    'position_similarity',  # 平均位置相似度
+    'average_similarity'    # 兩者的平均
+])
+
+
+# 在子 process 中對一個影片做姿勢偵測
+def extract_worker(args):
+    video, adjust, cache_dir = args
+    if cache_dir is not None:
+        return load_landmarks(video, adjust, cache_dir=cache_dir)
+    return extract_landmarks(video, adjust)
+
+
+# 把每個影片重新取樣到參考影片的幀率，並補齊或截斷到參考影片的長度
+# 回傳 landmarks: (N, T, 33, 4)，mask: (N, T)
+def stack_tracks(tracks, fps, length):
+    landmarks = np.zeros((len(tracks), length, 33, 4), dtype=np.float32)
+    mask = np.zeros((len(tracks), length), dtype=bool)
+    for i, track in enumerate(tracks):
+        track = resample_track(track, fps)
+        frames = min(length, len(track.mask))
+        landmarks[i, :frames] = track.landmarks[:frames]
+        mask[i, :frames] = track.mask[:frames]
+    return landmarks, mask
+
+
+# 參考影片 (T, 33, 4) 對 N 個影片 (N, T, 33, 4) 一次算完每一幀的相似度
+# 回傳每個影片的幀數與平均角度、位置、總平均相似度
+# weights、min_visibility 見 m.py 的 joint_weights，排除之後沒有任何一組可以比較的幀不列入
+def score_candidates(reference_landmarks, reference_mask, landmarks, mask, key_points=KEY_POINTS,
+                     weights=None, min_visibility=None):
+    # 參考影片的角度與座標會自動廣播到 N 個影片
+    with np.errstate(invalid='ignore', divide='ignore'):
+        angle, position, average = weighted_similarity(reference_landmarks[None], landmarks, key_points,
+                                                       weights, min_visibility)
+        valid = reference_mask[None] & mask & ~np.isnan(average)
+        frames = valid.sum(axis=1)
+
+        angle = np.where(valid, angle, 0).sum(axis=1) / frames
+        position = np.where(valid, position, 0).sum(axis=1) / frames
+    return frames, angle, position, (angle + position) / 2
+
+
+# 比對參考影片與多個影片，回傳依照總平均相似度由高到低排序的結果
+def rank_candidates(reference, candidates, adjust=3, processes=None, cache_dir=None, weights=None, min_visibility=None):
+    with Pool(processes) as pool:
+        # 參考影片與其他影片一起丟進 process pool，參考影片只偵測一次
+        tracks = pool.map(extract_worker, [(video, adjust, cache_dir) for video in [reference] + list(candidates)])
+    reference_track, candidate_tracks = tracks[0], tracks[1:]
+
+    landmarks, mask = stack_tracks(candidate_tracks, reference_track.fps, len(reference_track.mask))
+    frames, angle, position, average = score_candidates(
+        reference_track.landmarks, reference_track.mask, landmarks, mask, KEY_POINTS, weights, min_visibility)
+
+    results = [
+        candidate_result(video, int(frames[i]), float(angle[i]), float(position[i]), float(average[i]))
+        for i, video in enumerate(candidates)
+    ]
+    # 沒有任何一幀可以比較的影片排在最後
+    return sorted(results, key=lambda r: -r.average_similarity if r.frames else float('inf'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="one reference against many videos")
+    parser.add_argument('reference')
+    parser.add_argument('candidates', nargs='+')
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--processes', type=int, default=None, help="同時偵測的 process 數量，預設為 CPU 數量")
+    parser.add_argument('--cache-dir', default=None, help="骨架座標快取資料夾 (見 p.py)")
+    parser.add_argument('--ignore-face', action='store_true', help="臉的 5 組 (耳朵、眼睛、鼻子) 不列入相似度")
+    parser.add_argument('--min-visibility', type=float, default=None, help="visibility 不超過這個值的點所在的組不列入相似度")
+    args = parser.parse_args()
+
+    results = rank_candidates(args.reference, args.candidates, args.adjust, args.processes, args.cache_dir,
+                              BODY_WEIGHTS if args.ignore_face else None, args.min_visibility)
+
+    print(f"{'rank':>4}  {'video':<30} {'frames':>6} {'angle':>8} {'position':>9} {'average':>8}")
+    for rank, result in enumerate(results, 1):
+        print(f"{rank:>4}  {result.video:<30} {result.frames:>6} {result.angle_similarity:>7.2f}% "
+              f"{result.position_similarity:>8.2f}% {result.average_similarity:>7.2f}%")
@@ -0,0 +1,189 @@
+"""
+    批次比對多組影片
+    從 manifest (CSV 或 JSON) 讀取要比對的影片組合，分給多個 process 同時執行
+    每個 worker 啟動時在自己的 Pose 共用池 (見 v.py) 建立 Pose，之後每一組都重複使用，不必每次重新載入模型
+    每完成一組就寫一行到 JSONL，程式中斷後重新執行會跳過已經完成的組合
+    用法: python u.py pairs.csv -o results.jsonl --processes 4 --timeout 600 --retries 2
+
+    CSV 需要 video1, video2 兩個欄位，id 欄位可省略
+    JSON 為 [{"video1": ..., "video2": ..., "id": ...}, ...] 或 [[video1, video2], ...]
+"""
+
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+from l import skeleton_detection_similarity, result_to_dict
+from v import checkout, checkin
+
+# 每個 worker 的設定，在 init_worker 中設定
+worker_options = None
+
+# run(timeout) 每一幀才檢查一次，解碼卡住時不會停下來
+# 超過 timeout + 重試的等待 + 這個秒數 (worker 啟動時載入模型等) 還沒結束時，直接結束整個 Pool 再重新建立
+HARD_TIMEOUT_GRACE = 30.0
+
+
+# 讀取 manifest，回傳 [{'id', 'video1', 'video2'}, ...]
+def load_manifest(path):
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            rows = json.load(f)
+        rows = [row if isinstance(row, dict) else {'video1': row[0], 'video2': row[1]} for row in rows]
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    for row in rows:
+        jobs.append({
+            'id': row.get('id') or f"{row['video1']}|{row['video2']}",
+            'video1': row['video1'],
+            'video2': row['video2'],
+        })
+    return jobs
+
+
+# 讀取已經寫好的結果，回傳成功完成的 id
+def load_finished(output):
+    finished = set()
+    if not os.path.exists(output):
+        return finished
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 上一次中斷時寫到一半的行
+                continue
+            if record.get('status') == 'ok':
+                finished.add(record['id'])
+    return finished
+
+
+# worker 啟動時執行一次：在共用池中先建立兩個 Pose (每個影片一個)
+def init_worker(adjust, timeout, retries, retry_delay):
+    global worker_options
+    poses = [checkout(), checkout()]
+    for pose in poses:
+        checkin(pose)
+    worker_options = {'adjust': adjust, 'timeout': timeout, 'retries': retries, 'retry_delay': retry_delay}
+
+
+# 在 worker 中比對一組影片
+# 讀不到影片時 (例如還在上傳) 等一下再重試，超過時間則記錄為 timeout
+def run_job(job):
+    record = dict(job)
+    start = time.perf_counter()
+
+    for attempt in range(1, worker_options['retries'] + 2):
+        record['attempts'] = attempt
+
+        # run() 從共用池借 Pose，歸還時會清掉追蹤狀態，不會帶到下一組
+        sds = skeleton_detection_similarity(job['video1'], job['video2'], worker_options['adjust'], headless=True)
+        try:
+            result = sds.run(timeout=worker_options['timeout'])
+        except TimeoutError as e:
+            record.update(status='timeout', error=str(e))
+            break
+        except IOError as e:
+            record.update(status='error', error=str(e))
+            if attempt <= worker_options['retries']:
+                time.sleep(worker_options['retry_delay'])
+            continue
+        except Exception as e:
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+            break
+        finally:
+            sds.cap1.release()
+            sds.cap2.release()
+
+        record.update(status='ok', error=None, **result_to_dict(result))
+        break
+
+    record['seconds'] = time.perf_counter() - start
+    return record
+
+
+# 執行 manifest 中還沒完成的組合，結果一行一行寫到 output
+def run_batch(manifest, output, processes=None, adjust=3, timeout=None, retries=2, retry_delay=5.0):
+    jobs = load_manifest(manifest)
+    finished = load_finished(output)
+    pending = [job for job in jobs if job['id'] not in finished]
+    print(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already finished, {len(pending)} to run")
+
+    # 同時送出的組合不超過 worker 數量，送出時就開始執行，才能從送出的時間算出執行了多久
+    processes = processes or os.cpu_count() or 1
+    initargs = (adjust, timeout, retries, retry_delay)
+    hard_timeout = None if timeout is None else timeout + retries * retry_delay + HARD_TIMEOUT_GRACE
+    queue = deque(pending)
+    running = []                    # [(job, AsyncResult, 送出的時間)]
+    counts = {}
+
+    pool = Pool(processes, initializer=init_worker, initargs=initargs)
+    try:
+        with open(output, 'a', encoding='utf-8') as f:
+            while queue or running:
+                while queue and len(running) < processes:
+                    job = queue.popleft()
+                    running.append((job, pool.apply_async(run_job, (job,)), time.perf_counter()))
+
+                records = []
+                expired = False
+                for item in list(running):
+                    job, result, started = item
+                    elapsed = time.perf_counter() - started
+                    if not result.ready():
+                        if hard_timeout is None or elapsed < hard_timeout:
+                            continue
+                        records.append(dict(job, status='timeout', error=f"no result after {elapsed:.0f}s",
+                                            seconds=elapsed))
+                        expired = True
+                    else:
+                        try:
+                            records.append(result.get())
+                        except Exception as e:
+                            records.append(dict(job, status='error', error=f"{type(e).__name__}: {e}",
+                                                seconds=elapsed))
+                    running.remove(item)
+
+                # 卡住的 worker 無法單獨結束，結束整個 Pool，其他還在執行的組合重新排到最前面
+                if expired:
+                    pool.terminate()
+                    pool.join()
+                    queue.extendleft(reversed([job for job, _, _ in running]))
+                    running = []
+                    pool = Pool(processes, initializer=init_worker, initargs=initargs)
+
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+                    f.flush()
+                    counts[record['status']] = counts.get(record['status'], 0) + 1
+                    print(f"[{record['status']}] {record['id']} ({record['seconds']:.1f}s)")
+                if not records and running:
+                    running[0][1].wait(0.1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="batch skeleton detection similarity")
+    parser.add_argument('manifest', help="CSV 或 JSON 格式的影片組合")
+    parser.add_argument('-o', '--output', default='results.jsonl', help="輸出的 JSONL，同時作為中斷後繼續執行的紀錄")
+    parser.add_argument('--processes', type=int, default=None, help="worker 數量，預設為 CPU 數量")
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--timeout', type=float, default=None, help="每一組最多執行幾秒")
+    parser.add_argument('--retries', type=int, default=2, help="讀不到影片時重試幾次")
+    parser.add_argument('--retry-delay', type=float, default=5.0, help="重試前等待幾秒")
+    args = parser.parse_args()
+
+    counts = run_batch(args.manifest, args.output, args.processes, args.adjust,
+                       args.timeout, args.retries, args.retry_delay)
+    print(counts)
@@ -0,0 +1,84 @@
+"""
+    Pose 共用池
+    建立 Pose 需要載入模型與建立 graph，每次都重新建立要花好幾百毫秒
+    用完的 Pose 清掉追蹤狀態後放回池中，下一個影片直接拿來用
+    依照 model_complexity 與偵測、追蹤的信心值分開存放
+    mediapipe 載入要將近一秒，第一次建立 Pose 時才載入
+    用法:
+        with borrow(min_detection_confidence=0.5) as pose:
+            results = pose.process(frame)
+"""
+
+
+import threading
+from contextlib import contextmanager
+
+
+# mediapipe 姿勢偵測方法，第一次用到時才載入
+def load_mp_pose():
+    import mediapipe as mp
+    return mp.solutions.pose
+
+
+class pose_pool:
+    # max_idle: 每一種設定最多保留幾個閒置的 Pose，多的直接關閉
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle = {}      # 設定 -> 閒置的 Pose
+        self.keys = {}      # 借出去的 Pose -> 設定
+
+    # 借出一個 Pose，池中沒有符合設定的就建立新的
+    def checkout(self, model_complexity=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        key = (model_complexity, min_detection_confidence, min_tracking_confidence)
+        with self.lock:
+            idle = self.idle.get(key)
+            pose = idle.pop() if idle else None
+        if pose is None:
+            pose = load_mp_pose().Pose(
+                model_complexity=model_complexity,
+                min_detection_confidence=min_detection_confidence,
+                min_tracking_confidence=min_tracking_confidence)
+        with self.lock:
+            self.keys[pose] = key
+        return pose
+
+    # 歸還 Pose，清掉上一個影片的追蹤狀態後放回池中
+    def checkin(self, pose):
+        with self.lock:
+            key = self.keys.pop(pose)
+        try:
+            pose.reset()
+        except Exception:
+            pose.close()
+            return
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(pose)
+                return
+        pose.close()
+
+    # 借出並在離開 with 時自動歸還
+    @contextmanager
+    def borrow(self, model_complexity=1, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        pose = self.checkout(model_complexity, min_detection_confidence, min_tracking_confidence)
+        try:
+            yield pose
+        finally:
+            self.checkin(pose)
+
+    # 關閉所有閒置的 Pose
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for poses in idle.values():
+            for pose in poses:
+                pose.close()
+
+
+# 整個 process 共用的池
+pool = pose_pool()
+checkout = pool.checkout
+checkin = pool.checkin
+borrow = pool.borrow
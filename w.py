@@ -0,0 +1,196 @@
+"""
+    影片解碼的設定
+    opencv: 可以指定 FFmpeg 解碼執行緒數量，並在支援的環境使用硬體加速 (CAP_PROP_HW_ACCELERATION)
+    ffmpeg: 另外開一個 ffmpeg process 解碼，在解碼時就縮小，不必先解出 1080p 再 resize
+            每一幀直接寫進預先配置好的 buffer，用法與 cv2.VideoCapture 相同
+    latest_frame_reader: 在另一個執行緒一直讀取攝影機，只保留最新的一幀，處理不及的幀直接丟掉
+    用法: cap = open_video('B3.mp4', 'ffmpeg', adjust=3, threads=2)
+"""
+
+
+import shutil
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+
+# 可以選擇的解碼方式
+DECODERS = ('opencv', 'ffmpeg')
+
+
+# 用 ffmpeg process 解碼並縮小，輸出 raw 的 BGR 影像 (與 cv2.VideoCapture 相同，每個像素 3 bytes)
+# get() 回傳的長寬與原始影片相同，讀到的幀為長寬除以 adjust 的大小
+# retrieve() 回傳的是同一個 buffer，下一次 grab() 會覆寫，需要保留時要自己 copy()
+class ffmpeg_reader:
+    def __init__(self, video, adjust=1, threads=0, hw_acceleration=False, ffmpeg='ffmpeg'):
+        # 用 opencv 讀取影片資訊，不需要 ffprobe
+        probe = cv2.VideoCapture(video)
+        self.opened = probe.isOpened()
+        self.properties = {
+            prop: probe.get(prop)
+            for prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_COUNT)
+        }
+        probe.release()
+
+        self.fps = self.properties[cv2.CAP_PROP_FPS] or 30.0
+        # 打不開時 (例如即時模式的參考為 .npz) 長寬可能是負的
+        self.width = max(int(self.properties[cv2.CAP_PROP_FRAME_WIDTH]), 0) // adjust
+        self.height = max(int(self.properties[cv2.CAP_PROP_FRAME_HEIGHT]), 0) // adjust
+        self.buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self.index = 0          # 已經 grab() 的幀數
+        self.process = None
+        if not self.opened:
+            return
+        if not ffmpeg_available(ffmpeg):
+            raise RuntimeError(f"{ffmpeg} not found, install ffmpeg or use the opencv decoder")
+
+        command = [ffmpeg, '-v', 'error', '-nostdin']
+        if hw_acceleration:
+            command += ['-hwaccel', 'auto']
+        # 縮小用 bicubic，area 或 lanczos 縮小後遠處的人物 (例如 B3.mp4) 幾乎偵測不到
+        command += ['-threads', str(threads), '-i', video,
+                    '-vf', f'scale={self.width}:{self.height}:flags=bicubic',
+                    '-vsync', 'passthrough', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, bufsize=self.buffer.nbytes)
+
+    def isOpened(self):
+        return self.opened and self.process is not None
+
+    # 讀取下一幀到 buffer 中
+    def grab(self):
+        if self.process is None:
+            return False
+        view = memoryview(self.buffer).cast('B')
+        received = 0
+        while received < len(view):
+            n = self.process.stdout.readinto(view[received:])
+            if not n:
+                return False
+            received += n
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        if self.index == 0:
+            return False, None
+        return True, self.buffer
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.index)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return max(self.index - 1, 0) / self.fps * 1000
+        return self.properties.get(prop, 0.0)
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.process = None
+
+
+# 攝影機的幀如果排隊等著處理，延遲會一直累積，所以讀取執行緒只保留最新的一幀
+# read() 回傳還沒有回傳過的最新一幀，與讀到這一幀的時間 (time.perf_counter)
+# pace: 讀取影片檔時依照影片的時間播放，用影片模擬攝影機
+# ffmpeg_reader 每一幀都寫進同一個 buffer，處理中的幀會被下一幀覆寫，所以讀取執行緒中要先 copy()
+class latest_frame_reader:
+    def __init__(self, cap, pace=False):
+        self.cap = cap
+        self.pace = pace
+        self.copy = isinstance(cap, ffmpeg_reader)
+        self.condition = threading.Condition()
+        self.frame = None
+        self.captured_at = 0.0
+        self.index = 0          # 讀到的幀數
+        self.returned = 0       # 最後一次 read() 回傳的是第幾幀
+        self.dropped = 0        # 沒有被 read() 拿走就被新的幀蓋掉的幀數
+        self.stopped = False
+        self.error = None       # 讀取執行緒中發生的例外，read() 時丟出
+        self.thread = threading.Thread(target=self.worker, daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        start = time.perf_counter()
+        try:
+            while not self.stopped:
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                if self.copy:
+                    frame = frame.copy()
+                if self.pace:
+                    delay = start + self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000 - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self.condition:
+                    if self.index > self.returned:
+                        self.dropped += 1
+                    self.frame = frame
+                    self.captured_at = time.perf_counter()
+                    self.index += 1
+                    self.condition.notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            # 結束或發生錯誤時叫醒 read()，不會一直等下去
+            with self.condition:
+                self.stopped = True
+                self.condition.notify()
+
+    # 等到有新的一幀，回傳 (ret, frame, captured_at)，攝影機已經結束或等超過 timeout 秒時 ret 為 False
+    # timeout 為 None 時一直等到下一幀或攝影機結束 (攝影機打開後第一幀可能要等一秒以上)
+    def read(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.index > self.returned or self.stopped, timeout)
+            if self.index == self.returned:
+                if self.error is not None:
+                    raise self.error
+                return False, None, 0.0
+            self.returned = self.index
+            return True, self.frame, self.captured_at
+
+    def release(self):
+        with self.condition:
+            self.stopped = True
+        self.thread.join()
+        self.cap.release()
+
+
+# 是否可以使用 ffmpeg 解碼
+def ffmpeg_available(ffmpeg='ffmpeg'):
+    return shutil.which(ffmpeg) is not None
+
+
+# 依照設定打開影片
+# threads: 解碼執行緒數量，0 表示由 FFmpeg 決定
+# hw_acceleration: 有支援的話使用硬體解碼
+# adjust: 只有 ffmpeg 會在解碼時縮小，opencv 讀到的還是原始大小
+# 輸出都是 BGR：ffmpeg 直接輸出 rgb24 時色度內插的方式與 bgr24 不同，遠處的人物 (B3.mp4) 會偵測不到
+def open_video(video, decoder='opencv', adjust=1, threads=0, hw_acceleration=False):
+    if decoder == 'ffmpeg':
+        return ffmpeg_reader(video, adjust, threads, hw_acceleration)
+    if decoder != 'opencv':
+        raise ValueError(f"unknown decoder: {decoder}")
+
+    # 舊版 opencv 沒有這些屬性時就不設定
+    params = []
+    if hw_acceleration and hasattr(cv2, 'CAP_PROP_HW_ACCELERATION'):
+        params += [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY]
+    if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        params += [cv2.CAP_PROP_N_THREADS, threads]
+    if not params:
+        return cv2.VideoCapture(video)
+
+    cap = cv2.VideoCapture(video, cv2.CAP_FFMPEG, params)
+    if not cap.isOpened():
+        # 沒有 FFmpeg 後端或不支援這些參數時，改用預設的方式打開
+        cap = cv2.VideoCapture(video)
+    return cap
@@ -0,0 +1,116 @@
+"""
+    自動選擇姿勢偵測的解析度
+    送進 Pose 的影像越小越快，但太小時 landmark 會開始抖動，甚至偵測不到
+    在一段校正用的影片上，從小到大試每一種寬度
+    以最大寬度的結果為基準，選出 landmark 抖動沒有超過基準太多、偵測到的幀數也沒有明顯變少的最小寬度
+    抖動裡面也包含動作本身，動作快的影片數值本來就大，所以門檻是相對於基準的比例
+    landmark 是 0 ~ 1 的相對座標，不同寬度的結果可以直接比較
+    用法: python x.py B3.mp4 --frames 90 --tolerance 0.1
+"""
+
+
+import argparse
+from collections import namedtuple
+import cv2
+import numpy as np
+from m import KEY_POINTS, landmarks_to_array
+from v import borrow
+
+# 會嘗試的寬度，高度依照影片的比例
+INFERENCE_WIDTHS = (192, 256, 320, 384, 480, 640, 960, 1280, 1920)
+
+# 校正的結果
+calibration_result = namedtuple('calibration_result', [
+    'width',        # 選出的寬度
+    'jitter',       # {寬度: 抖動}
+    'detected'      # {寬度: 偵測到骨架的幀數}
+])
+
+
+# landmark 的抖動：連續三幀都有偵測到時，關鍵點位置的二次差分 (加速度) 的平均長度
+# 動作平順時二次差分很小，數值越大表示位置來回跳動得越厲害
+def landmark_jitter(landmarks, mask, key_points=KEY_POINTS):
+    points = landmarks[:, np.unique(key_points), :2]
+    valid = mask[:-2] & mask[1:-1] & mask[2:]
+    if not valid.any():
+        return float('inf')
+    second = points[2:] - 2 * points[1:-1] + points[:-2]
+    return float(np.linalg.norm(second[valid], axis=-1).mean())
+
+
+# 以寬度 width 對影片前 frames 幀做姿勢偵測，回傳 landmarks (T, 33, 4) 與 mask (T,)
+def detect_clip(video, width, frames=90, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open {video}")
+    source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    source_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    size = (width, max(round(source_height * width / source_width), 1))
+
+    landmarks = np.zeros((frames, 33, 4), dtype=np.float32)
+    mask = np.zeros(frames, dtype=bool)
+    rgb = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    count = 0
+    with borrow(
+        min_detection_confidence=min_detection_confidence,
+        min_tracking_confidence=min_tracking_confidence) as pose:
+
+        while count < frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            cv2.resize(frame, size, dst=rgb)
+            cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB, dst=rgb)
+            results = pose.process(rgb)
+            if results.pose_landmarks:
+                landmarks_to_array(results.pose_landmarks.landmark, out=landmarks[count])
+                mask[count] = True
+            count += 1
+    cap.release()
+    return landmarks[:count], mask[:count]
+
+
+# 選出抖動不超過最大寬度的 (1 + tolerance) 倍，且偵測到的幀數至少是最大寬度的 min_detected 倍的最小寬度
+# 寬度超過影片本身的不試，全部都不符合時使用最大的寬度
+def calibrate_inference_size(video, widths=INFERENCE_WIDTHS, tolerance=0.1, frames=90, min_detected=0.9,
+                             min_detection_confidence=0.5, min_tracking_confidence=0.5):
+    cap = cv2.VideoCapture(video)
+    source_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    cap.release()
+    widths = sorted(width for width in widths if width <= source_width) or [source_width]
+
+    jitter = {}
+    detected = {}
+
+    # 先用最大的寬度當作基準
+    largest = widths[-1]
+    landmarks, mask = detect_clip(video, largest, frames, min_detection_confidence, min_tracking_confidence)
+    jitter[largest] = landmark_jitter(landmarks, mask)
+    detected[largest] = int(mask.sum())
+
+    for width in widths[:-1]:
+        landmarks, mask = detect_clip(video, width, frames, min_detection_confidence, min_tracking_confidence)
+        jitter[width] = landmark_jitter(landmarks, mask)
+        detected[width] = int(mask.sum())
+        if jitter[width] <= (1 + tolerance) * jitter[largest] and detected[width] >= min_detected * detected[largest]:
+            return calibration_result(width, jitter, detected)
+    return calibration_result(largest, jitter, detected)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="calibrate inference size")
+    parser.add_argument('video')
+    parser.add_argument('--frames', type=int, default=90, help="校正用的幀數")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="landmark 抖動最多可以比最大寬度多幾成")
+    parser.add_argument('--all', action='store_true', help="試過所有寬度，不在找到後就停止")
+    args = parser.parse_args()
+
+    if args.all:
+        for width in INFERENCE_WIDTHS:
+            landmarks, mask = detect_clip(args.video, width, args.frames)
+            print(f"{width:>5}  jitter {landmark_jitter(landmarks, mask):.5f}  detected {mask.sum()}/{len(mask)}")
+    else:
+        result = calibrate_inference_size(args.video, tolerance=args.tolerance, frames=args.frames)
+        print(f"inference width: {result.width}")
+        for width in sorted(result.jitter):
+            print(f"{width:>5}  jitter {result.jitter[width]:.5f}  detected {result.detected[width]}")
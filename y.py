@@ -0,0 +1,107 @@
+"""
+    人物裁切 (ROI)
+    人在畫面中只佔一小部分時，整張縮小後送進 Pose 會浪費大部分的解析度
+    用上一幀 landmark 的範圍加上邊界，從原始大小的幀裁切出人物附近的區域再送進 Pose
+    偵測結果是裁切區域中的相對座標，再換算回整張畫面的相對座標
+    Pose 內部會用上一幀的結果追蹤，裁切範圍一變動，上一幀的位置就對不上新的座標
+    所以骨架還在裁切範圍內時不移動範圍，快碰到邊界時才重新裁切，移動時 (moved) 呼叫的一方要 reset Pose
+    連續幾幀偵測不到骨架時改用整張畫面
+"""
+
+
+import numpy as np
+
+
+class roi_tracker:
+    # margin: 骨架範圍四周各加上範圍大小的幾倍
+    # aspect: 裁切區域的寬高比 (像素)，與送進 Pose 的大小相同時縮小後不會變形
+    # visibility: 只用 visibility 大於這個值的點決定範圍
+    # min_size: 裁切區域最少佔畫面長寬的比例，避免範圍太小時只看到一部分身體
+    # patience: 連續幾幀偵測不到骨架之後改用整張畫面
+    def __init__(self, margin=0.5, aspect=16 / 9, visibility=0.5, min_size=0.2, patience=3):
+        self.margin = margin
+        self.aspect = aspect
+        self.visibility = visibility
+        self.min_size = min_size
+        self.patience = patience
+        self.region = None      # 下一幀要裁切的範圍 (x0, y0, x1, y1)，整張畫面的相對座標，None 表示用整張畫面
+        self.box = None         # 上一次實際裁切的範圍
+        self.moved = False      # 這一次裁切的範圍與上一次不同，Pose 內部追蹤的位置已經不對，要先 reset
+        self.misses = 0         # 連續偵測不到骨架的幀數
+
+    # 依照上一幀的結果裁切 frame，回傳裁切後的影像 (view) 與實際裁切的範圍 (相對座標，沒有裁切時為 None)
+    def crop(self, frame):
+        box = self.crop_box(frame.shape)
+        self.moved = box != self.box
+        self.box = box
+        if self.box is None:
+            return frame, None
+        height, width = frame.shape[:2]
+        x0, y0, x1, y1 = self.box
+        return frame[round(y0 * height):round(y1 * height), round(x0 * width):round(x1 * width)], self.box
+
+    # 依照 region 算出實際裁切的範圍 (相對座標)，需要整張畫面時回傳 None
+    def crop_box(self, shape):
+        if self.region is None:
+            return None
+        height, width = shape[:2]
+        x0, y0, x1, y1 = self.region
+
+        # 換成像素後調整成 aspect 的比例，以中心為準放大比較短的一邊
+        w = max((x1 - x0) * width, self.min_size * width)
+        h = max((y1 - y0) * height, self.min_size * height)
+        if w / h < self.aspect:
+            w = h * self.aspect
+        else:
+            h = w / self.aspect
+        # 超出畫面時縮小到畫面內，另一邊依照 aspect 重新算，縮小到推論的大小時才不會變形
+        if w > width:
+            w = width
+            h = w / self.aspect
+        if h > height:
+            h = height
+            w = h * self.aspect
+        if w >= width and h >= height:
+            return None
+
+        # 超出畫面時往內移動，不縮小範圍
+        cx = (x0 + x1) / 2 * width
+        cy = (y0 + y1) / 2 * height
+        left = int(round(min(max(cx - w / 2, 0), width - w)))
+        top = int(round(min(max(cy - h / 2, 0), height - h)))
+        right = left + int(round(w))
+        bottom = top + int(round(h))
+        return left / width, top / height, right / width, bottom / height
+
+    # 把裁切區域中的相對座標 (33, 3 以上) 換算回整張畫面的相對座標，直接修改 points
+    # z 與 x 使用相同的比例
+    @staticmethod
+    def to_frame(points, box):
+        x0, y0, x1, y1 = box
+        points[:, 0] = x0 + points[:, 0] * (x1 - x0)
+        points[:, 1] = y0 + points[:, 1] * (y1 - y0)
+        points[:, 2] *= x1 - x0
+        return points
+
+    # 依照這一幀的結果 (整張畫面的相對座標) 決定下一幀的裁切範圍，points 為 None 表示偵測不到
+    def update(self, points):
+        if points is None:
+            self.misses += 1
+            if self.misses > self.patience:
+                self.region = None
+            return
+        self.misses = 0
+
+        visible = points[:, 3] > self.visibility
+        xy = points[visible, :2] if visible.sum() >= 2 else points[:, :2]
+        xy = np.clip(xy, 0.0, 1.0)
+        (x0, y0), (x1, y1) = xy.min(axis=0), xy.max(axis=0)
+        dx = (x1 - x0) * self.margin
+        dy = (y1 - y0) * self.margin
+
+        # 骨架加上一半的邊界還在目前的裁切範圍內就不移動
+        if self.box is not None:
+            bx0, by0, bx1, by1 = self.box
+            if x0 - dx / 2 >= bx0 and y0 - dy / 2 >= by0 and x1 + dx / 2 <= bx1 and y1 + dy / 2 <= by1:
+                return
+        self.region = (x0 - dx, y0 - dy, x1 + dx, y1 + dy)
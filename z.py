@@ -0,0 +1,369 @@
+"""
+    多人模式
+    mediapipe 的 Pose 一次只能偵測一個人 (見 g.py)
+    先用背景模型 (或 HOG 人物偵測) 找出畫面中的每一個人，每個人裁切出來交給自己的 Pose (從共用池借，見 v.py)
+    之後用上一幀的骨架決定裁切範圍 (見 y.py)，只有新出現的人才需要靠偵測找到
+    每個人的 Pose 放在執行緒中平行執行
+    每個人都跟參考影片 (單人) 同一時間的骨架比較，相似度的算法與 l.py 相同
+    用法: python z.py reference.mp4 group.mp4 --max-people 6 --headless
+"""
+
+
+import argparse
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from l import skeleton_detection_similarity, result_to_dict
+from m import landmarks_to_array, array_to_landmarks
+from r import frame_pairer
+from s import similarity_stats
+from v import borrow, checkout, checkin
+from y import roi_tracker
+
+# 每個人的比對結果
+person_result = namedtuple('person_result', [
+    'person',               # 編號，依照出現的順序
+    'frames',               # 這個人與參考影片都有偵測到骨架的幀數
+    'angle_similarity',     # 平均角度相似度
+    'position_similarity',  # 平均位置相似度
+    'average_similarity'    # 兩者的平均
+])
+
+
+# 兩個範圍 (x0, y0, x1, y1) 重疊的面積佔 a 的比例
+def overlap(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    return w * h / max((a[2] - a[0]) * (a[3] - a[1]), 1e-9)
+
+
+# 找出畫面中的人，回傳每個人的範圍 (x0, y0, x1, y1)，整張畫面的相對座標
+# background: 背景模型中會動的區域，再用 connected components 分成一塊一塊，很快但鏡頭要固定
+# hog: opencv 內建的 HOG 行人偵測，鏡頭移動也可以用但比較慢，只能偵測站著的人
+class person_detector:
+    # width: 偵測時縮小到的寬度，預設 background 為 320，hog 為 640 (HOG 的視窗是 64x128，太小的人找不到)
+    # min_area: 一塊至少佔畫面的比例，太小的 (例如球、球拍) 不算
+    # warmup: background 最初的幾幀只更新背景模型不找人，第一幀整張畫面都會被當成前景
+    # (MOG2 在前 history 幀的學習率為 1 / 幀數，幾幀之內就會收斂)
+    def __init__(self, method='background', width=None, min_area=0.003, history=100, warmup=10):
+        self.method = method
+        self.width = width or (640 if method == 'hog' else 320)
+        self.min_area = min_area
+        self.warmup = warmup if method == 'background' else 0
+        self.frames = 0
+        if method == 'background':
+            self.subtractor = cv2.createBackgroundSubtractorMOG2(history=history, detectShadows=False)
+            self.kernel = np.ones((3, 3), dtype=np.uint8)
+            self.dilate_kernel = np.ones((7, 7), dtype=np.uint8)
+        elif method == 'hog':
+            self.hog = cv2.HOGDescriptor()
+            self.hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        else:
+            raise ValueError(f"unknown person detector: {method}")
+        self.small = None
+
+    # 縮小到偵測用的大小
+    def shrink(self, frame):
+        height, width = frame.shape[:2]
+        size = (self.width, max(round(height * self.width / width), 1))
+        if self.small is None or self.small.shape[1::-1] != size:
+            self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        return cv2.resize(frame, size, dst=self.small)
+
+    # 不需要找人時 (追蹤的人數已滿) 只更新背景模型，背景才不會過時；hog 不需要做任何事
+    def update(self, frame):
+        self.frames += 1
+        if self.method == 'background':
+            self.subtractor.apply(self.shrink(frame))
+
+    def detect(self, frame):
+        if self.frames < self.warmup:
+            self.update(frame)
+            return []
+        self.frames += 1
+        small = self.shrink(frame)
+        size = small.shape[1::-1]
+
+        if self.method == 'hog':
+            rects, weights = self.hog.detectMultiScale(small, winStride=(8, 8), padding=(8, 8), scale=1.05)
+            boxes = [(x, y, x + w, y + h) for (x, y, w, h), weight in zip(rects, np.ravel(weights)) if weight > 0.5]
+        else:
+            mask = self.subtractor.apply(small)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
+            mask = cv2.dilate(mask, self.dilate_kernel)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            min_pixels = self.min_area * size[0] * size[1]
+            boxes = [(x, y, x + w, y + h) for x, y, w, h, area in stats[1:] if area >= min_pixels]
+
+        return [(x0 / size[0], y0 / size[1], x1 / size[0], y1 / size[1]) for x0, y0, x1, y1 in boxes]
+
+
+# 畫面中的一個人：自己的 Pose、裁切範圍與相似度統計
+class person_track:
+    # box: 偵測到的範圍 (加上邊界)，shape: 畫面的大小
+    def __init__(self, person, box, pose, size, margin, shape):
+        self.person = person
+        self.pose = pose
+        # 送進 Pose 的是正方形，裁切範圍也是正方形 (像素)
+        # 偵測到的範圍先經過 crop_box 調整成正方形，整張畫面時也縮小到畫面內最大的正方形，不會被壓扁
+        self.roi = roi_tracker(margin, aspect=1.0, min_size=0.05)
+        self.roi.region = box
+        self.roi.region = self.roi.crop_box(shape) or self.full_square(shape)
+        self.buffer = np.empty((size, size, 3), dtype=np.uint8)
+        self.box = None
+        self.results = None
+        self.points = None
+        self.angle_stats = similarity_stats()
+        self.position_stats = similarity_stats()
+        self.average_stats = similarity_stats()
+
+    # 畫面中央最大的正方形 (相對座標)
+    @staticmethod
+    def full_square(shape):
+        height, width = shape[:2]
+        side = min(width, height)
+        x0 = (width - side) / 2 / width
+        y0 = (height - side) / 2 / height
+        return x0, y0, 1 - x0, 1 - y0
+
+    # 裁切並轉換成 RGB
+    def prepare(self, frame):
+        crop, self.box = self.roi.crop(frame)
+        # 裁切範圍移動時重新偵測，不用上一幀的追蹤位置 (見 y.py)
+        if self.roi.moved:
+            self.pose.reset()
+        cv2.resize(crop, self.buffer.shape[1::-1], dst=self.buffer)
+        cv2.cvtColor(self.buffer, cv2.COLOR_BGR2RGB, dst=self.buffer)
+
+    # 在執行緒中執行姿勢偵測
+    def process(self):
+        self.results = self.pose.process(self.buffer)
+
+    # 換算回整張畫面的座標並更新裁切範圍，回傳是否還要繼續追蹤
+    def update(self, draw=False):
+        self.points = None
+        if self.results.pose_landmarks:
+            self.points = landmarks_to_array(self.results.pose_landmarks.landmark)
+            if self.box is not None:
+                self.roi.to_frame(self.points, self.box)
+            if draw:
+                array_to_landmarks(self.points, self.results.pose_landmarks.landmark)
+        self.roi.update(self.points)
+        return self.roi.region is not None
+
+    # 骨架的範圍，沒有偵測到時用裁切範圍
+    def bounds(self):
+        if self.points is None:
+            return self.roi.region
+        xy = np.clip(self.points[:, :2], 0.0, 1.0)
+        return (*xy.min(axis=0), *xy.max(axis=0))
+
+    def result(self):
+        return person_result(
+            person=self.person,
+            frames=self.average_stats.count,
+            angle_similarity=float(self.angle_stats.mean),
+            position_similarity=float(self.position_stats.mean),
+            average_similarity=float(self.average_stats.mean))
+
+
+# video1 為參考影片 (單人)，video2 為多人的影片
+# 整體的相似度 (get_result) 為所有人所有幀的平均，每個人的結果見 people_results
+class multi_person_similarity(skeleton_detection_similarity):
+    def __init__(self, video1, video2, adjust=3, headless=False, detector='background', max_people=8,
+                 inference_size=256, margin=0.5, workers=None,
+                 min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        super().__init__(video1, video2, adjust, headless, min_detection_confidence, min_tracking_confidence)
+        self.detector = person_detector(detector)
+        self.max_people = max_people
+        self.person_size = inference_size
+        self.margin = margin
+        self.workers = workers or max_people
+        self.tracks = []
+        self.finished = []      # 已經離開畫面的人
+        self.next_person = 0
+
+    # 偵測到的人中，與目前追蹤中的人 (包含這一幀剛加入的) 沒有重疊的，建立新的追蹤
+    # 大部分在追蹤中的人裡面 (身體的一部分)，或蓋住追蹤中的人 (例如好幾個人連成一塊) 都不算
+    def add_people(self, boxes, shape):
+        for box in boxes:
+            if len(self.tracks) >= self.max_people:
+                break
+            if any(overlap(box, track.bounds()) > 0.5 or overlap(track.bounds(), box) > 0.5
+                   for track in self.tracks):
+                continue
+            pose = checkout(min_detection_confidence=self.min_detection_confidence,
+                            min_tracking_confidence=self.min_tracking_confidence)
+            dx = (box[2] - box[0]) * self.margin
+            dy = (box[3] - box[1]) * self.margin
+            region = (box[0] - dx, box[1] - dy, box[2] + dx, box[3] + dy)
+            self.tracks.append(person_track(self.next_person, region, pose, self.person_size, self.margin,
+                                            shape))
+            self.next_person += 1
+
+    # 停止追蹤並歸還 Pose
+    def drop(self, track):
+        self.tracks.remove(track)
+        checkin(track.pose)
+        if track.average_stats.count:
+            self.finished.append(track)
+
+    # 兩個人的骨架幾乎重疊時，表示後來的那個 Pose 追到了同一個人
+    def drop_duplicates(self):
+        for i, track in enumerate(self.tracks):
+            if track.points is None:
+                continue
+            for other in self.tracks[i + 1:]:
+                if other.points is not None and max(overlap(other.bounds(), track.bounds()),
+                                                    overlap(track.bounds(), other.bounds())) > 0.5:
+                    self.drop(other)
+                    return self.drop_duplicates()
+
+    def people_results(self):
+        return sorted((track.result() for track in self.finished + self.tracks), key=lambda r: r.person)
+
+    def run(self):
+        # 確認是否成功打開
+        if not self.cap1.isOpened():
+            if self.headless:
+                raise IOError("Cannot open camera1")
+            print("Cannot open camera1")
+            exit()
+        if not self.cap2.isOpened():
+            if self.headless:
+                raise IOError("Cannot open camera2")
+            print("Cannot open camera2")
+            exit()
+
+        pairer = frame_pairer(self.cap1, self.cap2)
+
+        # 合併的畫面，左邊參考影片，右邊多人的影片
+        combined_frame = np.zeros((max(self.resized_height1, self.resized_height2),
+                                   self.resized_width1 + 10 + self.resized_width2, 3), dtype=np.uint8)
+        combined_frame[:, self.resized_width1:self.resized_width1 + 10] = (0, 0, 255)  # 將分隔線設置為紅色
+        after1 = combined_frame[:self.resized_height1, :self.resized_width1]
+        after2 = combined_frame[:self.resized_height2, self.resized_width1 + 10:]
+        reference_frame = np.empty_like(after1)
+
+        with borrow(min_detection_confidence=self.min_detection_confidence,
+                    min_tracking_confidence=self.min_tracking_confidence) as reference_pose, \
+             ThreadPoolExecutor(self.workers) as executor:
+            try:
+                while True:
+                    ret, frame1, frame2 = pairer.read()
+                    if not ret:
+                        if not self.headless:
+                            print("Cannot receive frame")
+                        break
+
+                    # 參考影片
+                    cv2.resize(frame1, (self.resized_width1, self.resized_height1), dst=after1)
+                    cv2.cvtColor(after1, cv2.COLOR_BGR2RGB, dst=reference_frame)
+                    reference_results = reference_pose.process(reference_frame)
+                    reference_points = None
+                    if reference_results.pose_landmarks:
+                        reference_points = landmarks_to_array(reference_results.pose_landmarks.landmark)
+
+                    # 找出新出現的人，每個人裁切後平行做姿勢偵測
+                    # 追蹤的人數已滿時不會再加入新的人，不必找人
+                    if len(self.tracks) < self.max_people:
+                        self.add_people(self.detector.detect(frame2), frame2.shape)
+                    else:
+                        self.detector.update(frame2)
+                    for track in self.tracks:
+                        track.prepare(frame2)
+                    list(executor.map(person_track.process, self.tracks))
+
+                    for track in list(self.tracks):
+                        if not track.update(draw=not self.headless):
+                            self.drop(track)
+                    self.drop_duplicates()
+
+                    # 每個人都跟參考影片比較
+                    if reference_points is not None:
+                        for track in self.tracks:
+                            if track.points is None:
+                                continue
+                            similarity = self.calculate_similarity(reference_points, track.points)
+                            # 沒有任何一組可以比較 (nan) 時不列入，與 l.py 的 add_similarity 相同
+                            if np.isnan(similarity[2]):
+                                continue
+                            track.angle_stats.add(similarity[0])
+                            track.position_stats.add(similarity[1])
+                            track.average_stats.add(similarity[2])
+                            self.add_similarity(*similarity)
+
+                    # headless 模式不繪圖也不顯示
+                    if self.headless:
+                        continue
+
+                    cv2.resize(frame2, (self.resized_width2, self.resized_height2), dst=after2)
+                    self.mp_drawing.draw_landmarks(
+                        after1,
+                        reference_results.pose_landmarks,
+                        self.mp_pose.POSE_CONNECTIONS,
+                        landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
+                    for track in self.tracks:
+                        if track.points is None:
+                            continue
+                        self.mp_drawing.draw_landmarks(
+                            after2,
+                            track.results.pose_landmarks,
+                            self.mp_pose.POSE_CONNECTIONS,
+                            landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style())
+                        x0, y0 = track.bounds()[:2]
+                        cv2.putText(after2, str(track.person),
+                                    (int(x0 * self.resized_width2), max(int(y0 * self.resized_height2) - 4, 12)),
+                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
+                    cv2.imshow('Combined Video', combined_frame)
+
+                    # 按 'q' 鍵退出
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        break
+            finally:
+                for track in list(self.tracks):
+                    checkin(track.pose)
+                self.finished.extend(track for track in self.tracks if track.average_stats.count)
+                self.tracks = []
+
+        # 釋放視頻對象
+        self.cap1.release()
+        self.cap2.release()
+
+        result = self.get_result()
+        if self.headless:
+            return result
+
+        for person in self.people_results():
+            print(f"person {person.person}: {person.frames} frames, "
+                  f"angle {person.angle_similarity:.2f}%, position {person.position_similarity:.2f}%, "
+                  f"average {person.average_similarity:.2f}%")
+        print(f"Overall Average Similarity: {result.average_similarity:.2f}%")
+
+        # 關閉所有窗口
+        cv2.destroyAllWindows()
+        return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="multi-person skeleton detection similarity")
+    parser.add_argument('reference', help="參考影片 (單人)")
+    parser.add_argument('group', help="多人的影片")
+    parser.add_argument('--adjust', type=int, default=3, help="縮小倍率")
+    parser.add_argument('--headless', action='store_true', help="不繪圖也不顯示，只輸出結果 (JSON)")
+    parser.add_argument('--detector', choices=('background', 'hog'), default='background', help="找人的方式")
+    parser.add_argument('--max-people', type=int, default=8, help="最多同時追蹤幾個人")
+    parser.add_argument('--inference-size', type=int, default=256, help="每個人裁切後送進 Pose 的大小 (正方形)")
+    parser.add_argument('--workers', type=int, default=None, help="同時做姿勢偵測的執行緒數量，預設與 max-people 相同")
+    args = parser.parse_args()
+
+    sds = multi_person_similarity(args.reference, args.group, args.adjust, args.headless, args.detector,
+                                  args.max_people, args.inference_size, workers=args.workers)
+    result = sds.run()
+    if args.headless:
+        print(json.dumps({'overall': result_to_dict(result), 'people': [result_to_dict(p) for p in sds.people_results()]}))